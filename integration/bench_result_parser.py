@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the extraction of results from a large synthetic output, comparing the ResultParser used by
+Test.execute (regexes compiled once, RESULT prefilter, result flags looked up once per type) with the way
+parse_results worked before (each regex run over the whole output and the config looked up for each match).
+
+Usage: python3 integration/bench_result_parser.py [number of lines] [one RESULT line every N lines]
+"""
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from npf import npf
+from npf.result_parser import ResultParser
+from npf.section import SectionConfig
+
+
+def make_output(n, every):
+    lines = []
+    for i in range(n):
+        if i % every == 0:
+            lines.append("%d.%03d-RESULT-LATENCY%d %d.%dus\n" % (i // 1000, i % 1000, i % 7, i % 997, i % 10))
+        else:
+            lines.append("port 0: rx %d pkts, tx %d pkts, dropped %d, queue %d\n" % (i * 32, i * 31, i % 5, i % 16))
+    return lines
+
+
+def parse_before(config, output):
+    found = 0
+    for result_regex in config.get_list("result_regex"):
+        for nr in re.finditer(result_regex, output.strip(), re.IGNORECASE):
+            result_type = nr.group("type")
+            if float(nr.group("value")) != 0 or config.match("accept_zero", result_type) or nr.group("time_value") is not None:
+                config.get_bool_or_in("result_add", result_type)
+                config.get_bool_or_in("result_append", result_type)
+                config.get_bool_or_in("result_overwrite", result_type)
+                found += 1
+    return found
+
+
+def parse_streaming(config, lines):
+    parser = ResultParser(config.get_list("result_regex"), tail=1000, config=config)
+    sink = parser.sink()
+    for line in lines:
+        sink(0, line)
+    found = 0
+    for nr in parser.matches([sink]):
+        result_type = nr.group("type")
+        accept_zero, result_add, result_append, result_overwrite = parser.flags(result_type)
+        if float(nr.group("value")) != 0 or accept_zero or nr.group("time_value") is not None:
+            found += 1
+    return found
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    every = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    config = SectionConfig()
+    lines = make_output(n, every)
+    output = ''.join(lines)
+    print("%d lines (%.1f MB), one RESULT every %d lines" % (n, len(output) / 1024 / 1024, every))
+
+    start = time.perf_counter()
+    before = parse_before(config, output)
+    t_before = time.perf_counter() - start
+
+    start = time.perf_counter()
+    streaming = parse_streaming(config, lines)
+    t_streaming = time.perf_counter() - start
+
+    assert before == streaming, (before, streaming)
+    print("%-36s %6.2fs" % ("whole output, config per match", t_before))
+    print("%-36s %6.2fs" % ("line by line, prefilter, flag table", t_streaming))
+
+
+if __name__ == "__main__":
+    main()
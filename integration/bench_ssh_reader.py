@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the reading of the output of remote scripts, comparing the line splitting of SSHExecutor with
+the loop it used before (1KB reads appended to a string searched for new lines, lines appended to the output string).
+The output of a verbose tool is replayed from memory, so this only measures the controller CPU cost.
+
+Usage: python3 integration/bench_ssh_reader.py [MB of output]
+
+The previous loop is quadratic in the size of the output, keep the size small.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from npf import npf
+from npf.executor.executor import LineBuffer
+from npf.executor.sshexecutor import RECV_SIZE
+
+
+class ReplayChannel:
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.pos = 0
+
+    def recv_ready(self):
+        return self.pos < len(self.data)
+
+    def recv(self, n):
+        chunk = self.data[self.pos:self.pos + n].tobytes()
+        self.pos += len(chunk)
+        return chunk
+
+
+def read_string(chan):
+    output = ['', '']
+    buffer = ''
+    while chan.recv_ready():
+        data = chan.recv(1024)
+        buffer = buffer + data.decode("utf-8")
+        while "\n" in buffer:
+            p = buffer.index("\n")
+            line = buffer[:p+1]
+            buffer = buffer[p+1:]
+            output[0] += line
+    return output[0]
+
+
+def read_buffered(chan):
+    output = [[], []]
+    reader = LineBuffer()
+    while chan.recv_ready():
+        for line in reader.feed(chan.recv(RECV_SIZE)):
+            output[0].append(line)
+    output[0].append(reader.flush())
+    return ''.join(output[0])
+
+
+def main():
+    mb = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+    line = b"RESULT-PKT-LATENCY 12.345 port=0 queue=3 size=64 tsc=123456789012\n"
+    data = line * int(mb * 1024 * 1024 / len(line))
+    print("Reading %.1f MB of output, %d lines" % (len(data) / 1024 / 1024, len(data) // len(line)))
+    ref = None
+    for name, read in [("string, 1KB recv", read_string), ("LineBuffer, %dKB recv" % (RECV_SIZE // 1024), read_buffered)]:
+        start = time.perf_counter()
+        output = read(ReplayChannel(data))
+        t = time.perf_counter() - start
+        if ref is None:
+            ref = output
+        assert output == ref
+        print("%-24s %6.2fs  %7.1f MB/s" % (name, t, len(data) / 1024 / 1024 / t))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,35 @@
 from npf import repository
-from npf.grapher import Grapher
+from npf.grapher import Grapher, update_digest, lttb_indices, minmax_indices, smooth_range
 from npf.test_driver import Comparator
 import npf.npf
 from npf.node import *
 import argparse
+import re
+import os
+import hashlib
+import signal
+import threading
+import time
+import pickle
+import gc
+import io
+import tarfile
 from collections import OrderedDict
 
 from npf.repository import Repository
 from npf.test import Test
-from npf.build import Build
-from npf.variable import dtype, numeric_dict
-from npf.types.dataset import Run
+from npf.build import Build, ResultsCache, results_size
+from npf.eventbus import EventBus
+from npf.executor.executor import Executor, LineBuffer
+from npf.executor.sshexecutor import SSHPool, _plan_send, _parse_manifest, _local_file, _files_archive
+from npf.result_index import ResultIndex
+from npf.result_parser import ResultParser, requires_literal
+from npf.variable import dtype, numeric_dict, VariableFactory
+from npf.section import BruteVariableExpander, RandomVariableExpander, SectionConfig
+from npf.types import dataset
+from npf.types.dataset import Run, group_val, _group_all
+from npf.types.columnar import ColumnarDataset, write_columnar, read_columnar, has_columnar
+from npf.types.dataframe import results_dataframe
 
 import numpy as np
 
@@ -103,6 +122,272 @@ def test_runequality():
     assert a.__hash__() != h
     assert a != b
 
+def test_results_journal(tmp_path):
+    args = get_args()
+    test = Test("tests/examples/math.npf", options=args, tags=args.tags)
+    build = Build(get_repo(), "version", result_path=[str(tmp_path)])
+
+    a = Run(OrderedDict([("N", 1)]))
+    b = Run(OrderedDict([("N", 2)]))
+    build.writeversion(test, OrderedDict([(a, {"LAT": [1.0, 2.0]})]), allow_overwrite=True)
+    build.journalversion(test, {b: {"LAT": [3.0]}})
+    build.journalversion(test, {a: {"LAT": [4.0]}})
+
+    results = Build(build.repo, "version", result_path=[str(tmp_path)]).load_results(test)
+    assert list(results.keys()) == [a, b]
+    assert results[a] == {"LAT": [4.0]}
+    assert results[b] == {"LAT": [3.0]}
+
+    build.compact(test)
+    assert not list(tmp_path.rglob("*.journal"))
+    assert Build(build.repo, "version", result_path=[str(tmp_path)]).load_results(test) == results
+
+def test_results_columnar(tmp_path):
+    args = get_args()
+    test = Test("tests/examples/math.npf", options=args, tags=args.tags)
+    build = Build(get_repo(), "version", result_path=[str(tmp_path)])
+
+    results = OrderedDict()
+    results[Run(OrderedDict([("N", 1), ("MODE", "a:b")]))] = {"LAT": [1.5, 2.0], "THR": None}
+    results[Run(OrderedDict([("N", 2)]))] = {"LAT": [3.0]}
+    build.writeversion(test, results, allow_overwrite=True)
+    text = build.load_results(test, cache=False)
+
+    npf.options.result_format = "columnar"
+    try:
+        build.writeversion(test, results, allow_overwrite=True)
+    finally:
+        npf.options.result_format = "text"
+    assert list(tmp_path.rglob("*.columns"))
+    assert not list(tmp_path.rglob("*.results"))
+    columnar = build.load_results(test, cache=False)
+    assert columnar == text
+    assert [r.read_variables() for r in columnar] == [r.read_variables() for r in text]
+
+    #Writing the text format removes the columnar copy, also when the write was interrupted before
+    filename = str(next(tmp_path.rglob("*.columns")))[:-len(".columns")]
+    with open(filename + ".new", "w") as f:
+        f.write(Build._format_line(*list(results.items())[1]))
+    assert len(build.load_results(test, cache=False)) == 1
+    assert not list(tmp_path.rglob("*.columns")) and not list(tmp_path.rglob("*.new"))
+    build.writeversion(test, results, allow_overwrite=True)
+    assert dict(build.load_results(test, cache=False)) == dict(text)
+
+    #A write interrupted after the previous folder was moved aside does not lose it
+    path = str(tmp_path / "results.columns")
+    write_columnar(path, results)
+    write_columnar(path, results)
+    os.rename(path, path + ".old")
+    assert has_columnar(path)
+    assert isinstance(read_columnar(path).values("LAT"), np.memmap)
+    assert read_columnar(path).to_dataset() == results
+
+def test_results_cache(tmp_path):
+    args = get_args()
+    test = Test("tests/examples/math.npf", options=args, tags=args.tags)
+    build = Build(get_repo(), "version", result_path=[str(tmp_path)])
+    a = Run(OrderedDict([("N", 1)]))
+    build.writeversion(test, OrderedDict([(a, {"LAT": [1.0]})]), allow_overwrite=True)
+
+    hits = Build.cache.hits
+    results = Build(build.repo, "version", result_path=[str(tmp_path)]).load_results(test)
+    assert Build(build.repo, "version", result_path=[str(tmp_path)]).load_results(test) == results
+    assert Build.cache.hits == hits + 2
+
+    #Changing loaded results, like --use-last does with the results of an older version, does not change the cache
+    results[a]["LAT"].append(99.0)
+    assert Build(build.repo, "version", result_path=[str(tmp_path)]).load_results(test)[a] == {"LAT": [1.0]}
+
+    build.journalversion(test, {a: {"LAT": [2.0]}})
+    assert Build(build.repo, "version", result_path=[str(tmp_path)]).load_results(test)[a] == {"LAT": [2.0]}
+
+    #The bound is on the memory of the parsed values, not on their size on disk
+    small = OrderedDict([(a, {"LAT": [1.0] * 10})])
+    big = OrderedDict([(a, {"LAT": [1.0] * 10000})])
+    assert results_size(big) > 10000 * 8 > results_size(small)
+    cache = ResultsCache(max_bytes=results_size(big) - 1)
+    cache.put(str(tmp_path / "small"), small)
+    cache.put(str(tmp_path / "big"), big)
+    assert len(cache) == 1 and cache.bytes == results_size(small)
+
+def test_result_index(tmp_path):
+    args = get_args()
+    test = Test("tests/examples/math.npf", options=args, tags=args.tags)
+    repo = get_repo()
+    old = Build(repo, "old", result_path=[str(tmp_path)])
+    new = Build(repo, "new", result_path=[str(tmp_path)])
+    a = Run(OrderedDict([("N", 1)]))
+    b = Run(OrderedDict([("N", 2)]))
+    old.writeversion(test, OrderedDict([(a, {"LAT": [1.0]}), (b, {"LAT": [2.0]})]), allow_overwrite=True)
+    new.writeversion(test, OrderedDict([(b, {"LAT": [3.0]})]), allow_overwrite=True)
+
+    index = ResultIndex(old.result_folder())
+    index.update(test, [new, old])
+    assert index.lookup(test, Run(OrderedDict([("N", "2")])), ["new", "old"]) == "new"
+    assert index.lookup(test, a, ["new", "old"]) == "old"
+    assert index.lookup(test, Run(OrderedDict([("N", 3)])), ["new", "old"]) is None
+
+    new.journalversion(test, {a: {"LAT": [4.0]}})
+    index.update(test, [new, old])
+    assert index.lookup(test, a, ["new", "old"]) == "new"
+    index.close()
+
+def test_runkey():
+    a = Run(OrderedDict([("A", 1), ("B", 2)]))
+    b = Run(OrderedDict([("A", 2), ("B", 1)]))
+    assert a != b
+    assert hash(a) != hash(b)
+    c = Run(OrderedDict([("B", "2"), ("A", 1.0)]))
+    assert a == c
+    assert a.key() is c.key()
+    assert Run(OrderedDict([("A", "x")])) != Run(OrderedDict([("A", "y")]))
+    assert pickle.loads(pickle.dumps(a)) == a
+
+    #Keys leave the interning table with the last run using them
+    n = len(dataset._run_keys)
+    d = Run(OrderedDict([("A", 1), ("B", 3)]))
+    assert hash(d) and len(dataset._run_keys) == n + 1
+    e = pickle.loads(pickle.dumps(d))
+    assert e == d and e.key() is d.key()
+    del d, e
+    gc.collect()
+    assert len(dataset._run_keys) == n
+    assert Run(OrderedDict([("A", 1), ("B", 2)])).key() is a.key()
+
+def test_columnar_dataset():
+    results = OrderedDict()
+    results[Run(OrderedDict([("N", 1)]))] = {"LAT": [1.0, 2.0, 6.0], "THR": None}
+    results[Run(OrderedDict([("N", 2), ("M", "x")]))] = {"LAT": [3.0]}
+    results[Run(OrderedDict([("N", 3)]))] = {"LAT": []}
+    c = ColumnarDataset.from_dataset(results)
+    assert len(c) == 3
+    assert c.to_dataset() == results
+    assert list(c.column("M")) == [None, "x", None]
+    assert list(c.lengths("LAT")) == [3, 1, 0]
+    assert np.allclose(c.mean("LAT")[:2], [3.0, 3.0])
+    assert np.isnan(c.mean("LAT")[2])
+    assert np.allclose(c.std("LAT")[:2], [np.std([1.0, 2.0, 6.0]), 0])
+
+def test_group_all():
+    rng = np.random.default_rng(0)
+    for group in ["mean", "std", "min", "max", "perc95", "median", "n", "first"]:
+        results = OrderedDict()
+        runs = []
+        for i in range(40):
+            run = Run(OrderedDict([("N", i)]))
+            runs.append(run)
+            if i % 7 == 0:
+                continue
+            empty = i % 9 == 0 and group in ["mean", "std", "n"]
+            results[run] = {"LAT": [] if empty else list(rng.standard_normal(i % 5 + 1) * 1000)}
+        runs.append(Run(OrderedDict([("N", 100)])))
+        columnar = ColumnarDataset.from_dataset(results, runs=runs)
+        y, e = _group_all(results, runs, columnar, "LAT", group)
+        for run, yv, ev in zip(runs, y, e):
+            result = results.get(run, {}).get("LAT", None)
+            if result is None:
+                assert np.isnan(yv) and np.isnan(ev[0]) and np.isnan(ev[1])
+                continue
+            with np.errstate(invalid="ignore"):
+                assert np.array_equal(yv, group_val(result, group), equal_nan=True)
+                assert np.array_equal([ev[0], ev[1]], [np.mean(result), np.std(result)], equal_nan=True)
+            assert ev[2] is result
+
+def test_expander():
+    args = get_args()
+    test = Test("tests/examples/math.npf", options=args, tags=args.tags)
+    vlist = OrderedDict()
+    vlist["A"] = VariableFactory.build("A", "[1-3]")
+    vlist["B"] = VariableFactory.build("B", "{x,y}")
+    vlist["C"] = VariableFactory.build("C", "[5-6]")
+    vlist["D"] = VariableFactory.build("D", "7")
+    e = BruteVariableExpander(vlist, set(["D"]))
+    points = list(e)
+    assert len(e) == len(points) == 12
+    assert points[0] == OrderedDict([("A", 1), ("B", "x"), ("C", 5)])
+    assert points[1] == OrderedDict([("A", 2), ("B", "x"), ("C", 5)])
+    assert points[-1] == OrderedDict([("A", 3), ("B", "y"), ("C", 6)])
+    assert [e[i] for i in range(len(e))] == points
+    assert e[-1] == points[-1]
+
+    r = RandomVariableExpander(vlist, set(["D"]))
+    assert len(r) == 12
+    assert sorted(list(r), key=lambda p: points.index(p)) == points
+    assert len(test.variables.expand()) == len(list(test.variables.expand()))
+
+def test_shards(tmp_path):
+    args = get_args()
+    test = Test("tests/examples/math.npf", options=args, tags=args.tags)
+    shards = [list(test.variables.expand(shard=(i, 3))) for i in range(1, 4)]
+    points = list(test.variables.expand())
+    assert sum(len(s) for s in shards) == len(points)
+    assert sorted([p for s in shards for p in s], key=lambda p: points.index(p)) == points
+    assert len(test.variables.expand(shard=(2, 3))) == len(shards[1])
+
+    build = Build(get_repo(), "version", result_path=[str(tmp_path)])
+    for i in range(1, 4):
+        build.writeversion(test, OrderedDict([(Run(OrderedDict([("N", i)])), {"N": [float(i)]})]), allow_overwrite=True, shard=(i, 3))
+    assert not build.load_results(test)
+    assert build.load_results(test, shard=(2, 3))
+    assert build.merge_shards(test) == 3
+    assert len(build.load_results(test)) == 3
+
+    #Merged shards are removed, a later merge does not overwrite runs done since
+    assert not build.load_results(test, shard=(2, 3))
+    build.writeversion(test, OrderedDict([(Run(OrderedDict([("N", 2)])), {"N": [5.0]})]), allow_overwrite=True)
+    assert build.merge_shards(test) == 0
+    assert build.load_results(test)[Run(OrderedDict([("N", 2)]))] == {"N": [5.0]}
+
+def test_executor_pool(tmp_path):
+    args = get_args()
+    args.do_test = True
+    npf.create_local()
+    npf_file = tmp_path / "pool.npf"
+    npf_file.write_text("%variables\nN=[1-2]\n\n%script\necho \"RESULT-A $N\"\n\n%script\necho \"RESULT-B 1\"\n")
+    test = Test(str(npf_file), options=args, tags=args.tags)
+    build = Build(repository.Repository.get_instance("local", options=args), "version", result_path=[str(tmp_path)])
+
+    pools = []
+    executor_pool = test.executor_pool
+    test.executor_pool = lambda n: pools.append((n, executor_pool(n))) or pools[-1][1]
+    all_results, _, _ = test.execute_all(build, args, do_test=True)
+    assert len(all_results) == 2
+    #All the runs of both points used the same pool of two threads, released at the end of the test
+    assert len(pools) > 2 and all(pool == pools[0] for pool in pools) and pools[0][0] == 2
+    assert test._pool is None
+
+    del test.executor_pool
+    p = test.executor_pool(2)
+    assert test.executor_pool(1) is p
+    q = test.executor_pool(3)
+    assert q is not p and test._pool_size == 3
+    assert q.apply(lambda: 1) == 1
+    test.close_pool()
+    assert test._pool is None
+
+def test_unstable_results():
+    args = get_args()
+    test = Test("tests/examples/math.npf", options=args, tags=args.tags)
+    test.config["n_runs_ci"] = 0.05
+    results = {"STABLE": [10.0, 10.1, 9.9, 10.0], "NOISY": [1.0, 10.0, 5.0, 20.0], "SINGLE": [1.0], "LOG": [0, 5]}
+    assert test.unstable_results(results) == ["NOISY", "SINGLE"]
+
+def test_eventbus():
+    e = EventBus()
+    e.post("READY")
+    e.listen("READY")
+    t = threading.Thread(target=lambda: (time.sleep(0.1), e.post("GO")))
+    t.start()
+    e.listen("GO")
+    t.join()
+    start = time.monotonic()
+    e.wait_for_termination(0.1)
+    assert time.monotonic() - start >= 0.1
+    assert not e.is_terminated()
+    threading.Timer(0.05, e.terminate).start()
+    e.listen("NEVER")
+    assert e.is_terminated()
+
 def test_local_executor():
     l = LocalExecutor()
     pid, stdout, stderr, ret = l.exec("echo TEST")
@@ -129,6 +414,257 @@ def test_local_executor():
     assert stderr == ""
     assert ret == 1
 
+    start = time.monotonic()
+    pid, stdout, stderr, ret = l.exec("echo TEST; sleep 5", timeout=0.5)
+    assert pid == 0
+    assert stdout == "TEST\n"
+    assert time.monotonic() - start < 2
+
+    e = EventBus()
+    threading.Timer(0.2, e.terminate).start()
+    start = time.monotonic()
+    pid, stdout, stderr, ret = l.exec("echo EVENT READY; sleep 5", event=e)
+    os.killpg(pid, signal.SIGKILL)
+    assert "READY" in e.events
+    assert ret == 0
+    assert time.monotonic() - start < 2
+
+
+def test_line_buffer():
+    b = LineBuffer()
+    assert b.feed(b"RESULT 1\nRES") == ["RESULT 1\n"]
+    assert b.feed(b"ULT \xc3") == []
+    assert b.feed(b"\xa9\r\nA\n\nB") == ["RESULT \u00e9\r\n", "A\n", "\n"]
+    assert b.flush() == "B"
+    assert b.flush() == ""
+
+
+def test_write_files_skip():
+    class RecordingExecutor(Executor):
+        def __init__(self):
+            super().__init__()
+            self.written = []
+
+        def writeFile(self, filename, path_to_root, content, sudo=False):
+            self.written.append(filename)
+            return True
+
+    e = RecordingExecutor()
+    assert e.writeFiles([("a", "1"), ("b", "22")], "test", skip_unchanged=True)
+    assert e.writeFiles([("a", "1"), ("b", "23")], "test", skip_unchanged=True)
+    assert e.written == ["a", "b", "b"]
+    assert e.bytes_saved == 1
+    assert e.writeFiles([("a", "1")], "other", skip_unchanged=True)
+    assert e.writeFiles([("a", "1")], "test")
+    assert e.written == ["a", "b", "b", "a", "a"]
+
+
+
+def test_send_plan(tmp_path):
+    local = {"a": (10, 100, 0o644), "b": (20, 100, 0o644), "c": (30, 100, 0o644), "d": (40, 100, 0o644), "e": (50, 100, 0o644)}
+    remote = {"a": (10, 100), "b": (21, 100), "c": (30, 200), "d": (40, 300)}
+    assert _plan_send(local, remote) == (["b", "e", "c", "d"], [], 10)
+    #Same size and another time : only those with the same content are skipped
+    same = lambda names: [n for n in names if n == "c"]
+    assert _plan_send(local, remote, same) == (["b", "e", "d"], ["c"], 40)
+    assert _plan_send(local, remote, lambda names: []) == (["b", "e", "c", "d"], [], 10)
+
+    files, dirs = _parse_manifest("f\ta\t10\t100.5\nd\tsub\nf\tsub/b c\t0\t1700000000.0000000000\nbad line\n")
+    assert files == {"a": (10, 100), "sub/b c": (0, 1700000000)}
+    assert dirs == {"sub"}
+    assert _parse_manifest("") == ({}, set())
+
+    f = tmp_path / "file.txt"
+    f.write_text("hello")
+    os.utime(f, (1000, 1000))
+    lroot, files = _local_file(str(f))
+    assert lroot == str(tmp_path)
+    assert {k: v[:2] for k, v in files.items()} == {"file.txt": (5, 1000)}
+    assert _plan_send(files, {"file.txt": (5, 1000)}) == ([], [], 5)
+    assert _plan_send(files, {}) == (["file.txt"], [], 0)
+
+
+def test_files_archive(tmp_path):
+    files = [("a.sh", "echo 1\n"), ("sub/dir/b.txt", "\u00e9t\u00e9"), ("empty", "")]
+    archive = _files_archive(files)
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        assert tar.getnames() == ["a.sh", "sub/dir/b.txt", "empty"]
+        assert [tar.extractfile(m).read().decode() for m in tar.getmembers()] == [content for _, content in files]
+        assert all(m.isfile() and m.mode == 0o644 for m in tar.getmembers())
+        tar.extractall(tmp_path)
+    assert (tmp_path / "sub" / "dir" / "b.txt").read_text(encoding="utf-8") == "\u00e9t\u00e9"
+
+def test_ssh_pool():
+    class FakeTransport:
+        def __init__(self):
+            self.active = True
+
+        def is_active(self):
+            return self.active
+
+        def set_keepalive(self, interval):
+            pass
+
+    class FakeClient:
+        def __init__(self):
+            self.transport = FakeTransport()
+            self.closed = False
+
+        def get_transport(self):
+            return self.transport
+
+        def close(self):
+            self.closed = True
+
+    pool = SSHPool(FakeClient, max_sessions=2)
+    a = pool.acquire()
+    b = pool.acquire()
+    assert a is b
+    c = pool.acquire()
+    assert c is not a
+    pool.release(b)
+    assert pool.acquire() is a
+
+    #A dead connection is not given anymore, and closed once released by all its users
+    a.transport.active = False
+    assert pool.acquire() is c
+    d = pool.acquire()
+    assert d is not a and d is not c
+    pool.release(a)
+    assert not a.closed
+    pool.release(a)
+    assert a.closed
+
+    pool.release(c, dead=True)
+    assert not c.closed
+    pool.release(c)
+    assert c.closed
+    pool.close()
+    assert d.closed
+
+    #Users keeping several channels open take as many slots
+    pool = SSHPool(FakeClient, max_sessions=2)
+    a = pool.acquire(sessions=2)
+    b = pool.acquire()
+    assert b is not a
+    pool.release(a, sessions=2)
+    assert pool.acquire() is a
+    assert pool.acquire(new=True) not in (a, b)
+
+
+def test_result_parser():
+    regex = SectionConfig().get_list("result_regex")
+    output = "RESULT-A 1\nnoise\n3-RESULT-B 2ms\nRESULT-A 3\n"
+    parser = ResultParser(regex, tail=2)
+    assert parser.streaming
+    assert parser.prefiltered == [True]
+    assert not requires_literal("A|RESULT", "RESULT")
+    assert not requires_literal("(RESULT)?[0-9]+", "RESULT")
+    assert requires_literal("RESULT-(?P<unit>s|sec)?", "RESULT")
+    sink = parser.sink()
+    for line in output.splitlines(keepends=True):
+        sink(0, line)
+    sink(1, "err\n")
+    found = [(m.group("type"), m.group("value")) for m in parser.matches(["RESULT-C 4", sink])]
+    expected = [(m.group("type"), m.group("value")) for m in re.finditer(regex[0], "RESULT-C 4" + output, re.IGNORECASE)]
+    assert found == expected == [("C", "4"), ("A", "1"), ("B", "2"), ("A", "3")]
+    assert sink.output(0) == "[2 lines not kept]\n3-RESULT-B 2ms\nRESULT-A 3\n"
+    assert sink.output(1) == "err\n"
+
+    #Regexes that may span lines are run over the whole output
+    parser = ResultParser([r"RESULT-(?P<type>[A-Z]+)\s+(?P<value>[0-9]+)"], tail=1)
+    assert not parser.streaming
+    sink = parser.sink()
+    l = LocalExecutor()
+    pid, stdout, stderr, ret = l.exec("echo RESULT-X; echo 5", sink=sink)
+    assert stdout == ""
+    assert [(m.group("type"), m.group("value")) for m in parser.matches([sink])] == [("X", "5")]
+
+
+
+def test_graph_digest():
+    def digest(obj):
+        h = hashlib.sha256()
+        update_digest(h, obj)
+        return h.hexdigest()
+    y = np.zeros(10000)
+    z = y.copy()
+    z[5000] = 1
+    #The repr of both arrays is the same
+    assert digest(y) != digest(z)
+    assert digest({"A": [Run({"N": 1}), {"b", "a"}]}) == digest({"A": [Run({"N": 1}), {"a", "b"}]})
+    assert digest([1, 2]) != digest([[1], 2])
+
+
+def test_downsample():
+    x = np.arange(10000.)
+    y = np.sin(x / 100)
+    y[1234] = 10
+    y[5678] = -10
+    for idx in (lttb_indices(x, y, 500), minmax_indices(y, 500)):
+        assert len(idx) <= 500
+        assert idx[0] == 0 and idx[-1] == len(x) - 1
+        assert np.all(np.diff(idx) > 0)
+        assert 1234 in idx and 5678 in idx
+    assert list(lttb_indices(x[:10], y[:10], 20)) == list(range(10))
+
+
+def test_smooth_range():
+    def reference(x, y, r, newx):
+        #Previous implementation, computing a mask over all x for each point
+        new_y = tuple([] for _ in range(len(y)))
+        for x_v in newx:
+            mask = np.logical_and(x > (x_v - r), x < (x_v + r))
+            for i in range(len(y)):
+                new_y[i].append(np.mean(y[i][mask]) if mask.any() else np.nan)
+        return tuple([np.asarray(y) for y in new_y])
+
+    assert np.allclose(smooth_range(np.array([1., 2, 3, 4]), (np.array([1., 2, 3, 10]),), 1.5, [1, 2.5, 4, 8])[0],
+                       [1.5, 2.5, 6.5, np.nan], equal_nan=True)
+    rng = np.random.default_rng(42)
+    x = rng.integers(0, 50, 300).astype(float)
+    y = tuple(rng.normal(1000, 10, (4, 300)))
+    y[1][17] = np.nan
+    y[2][42] = np.inf
+    newx = np.arange(-5, 55, 0.5)
+    for r in (0.5, 2, 10):
+        for new, old in zip(smooth_range(x, y, r, newx), reference(x, y, r, newx)):
+            assert np.allclose(new, old, equal_nan=True)
+
+
+def test_graph_jobs(tmp_path):
+    args = get_args()
+    args.graph_size = None
+    test = Test("tests/examples/math.npf", options=args, tags=args.tags)
+    build = Build(get_repo(), "version")
+    results = OrderedDict((Run(OrderedDict([("N", n)])), {"A": [float(n)], "B": [n * 2.0], "C": [1.0 / n]}) for n in range(1, 5))
+    times = OrderedDict((Run(OrderedDict([("time", float(t))])), {"A": [float(t)], "B": [t * 3.0]}) for t in range(5))
+    files = []
+    for jobs in (1, 2):
+        args.graph_jobs = jobs
+        filename = str(tmp_path / str(jobs) / "graph.pdf")
+        grapher = Grapher()
+        grapher.graph(series=[(test, build, results)], filename=filename, options=args)
+        grapher.graph(series=[(test, build, times)], filename=filename, fileprefix="time", options=args)
+        grapher.wait()
+        files.append(sorted(f for f in os.listdir(tmp_path / str(jobs)) if f.endswith(".pdf")))
+    assert len(files[0]) == 5
+    assert files[0] == files[1]
+
+
+def test_results_dataframe():
+    build = Build(get_repo(), "version")
+    results = OrderedDict()
+    results[Run({"N": 1})] = {"A": [1.0, 2.0], "B": [3.0]}
+    results[Run({"N": 2})] = {}
+    results[Run({"N": 3, "M": "x"})] = {"C": [4.0]}
+    df = results_dataframe([(None, build, results)])
+    assert list(df.columns) == ["build", "test_index", "N", "y_A", "y_B", "run_index", "M", "y_C"]
+    assert list(df["test_index"]) == [0, 0, 2]
+    assert list(df["run_index"]) == [0, 1, 0]
+    assert np.allclose(df["y_B"], [3.0, np.nan, np.nan], equal_nan=True)
+    assert list(df["M"].isna()) == [True, True, False]
+    assert results_dataframe([]).empty
 
 def test_core():
         parser = argparse.ArgumentParser(description='NPF test')
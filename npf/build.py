@@ -1,4 +1,5 @@
 import os
+import shutil
 import subprocess
 from collections import OrderedDict
 from subprocess import PIPE
@@ -6,7 +7,10 @@ from pathlib import Path
 import re
 from npf import variable, npf
 from npf.types.dataset import Run, Dataset
+from npf.types.columnar import COLUMNAR_EXT, write_columnar, read_columnar, has_columnar
 import copy
+import sys
+import threading
 
 renametable = {
     'npf.script': 'npf.npf',
@@ -27,7 +31,144 @@ def mapped_load_global(self):
     self.append(klass)
 
 
+#Runs appended since the last rewrite of a results file are kept in a journal next to it
+JOURNAL_EXT = '.journal'
+#Journals smaller than this are never compacted before the end of the test
+JOURNAL_MIN_COMPACT = 1024 * 1024
+#Text results file being written, and once complete, waiting to replace the previous one
+TMP_EXT = '.tmp'
+NEW_EXT = '.new'
+
+
+def copy_results(results: Dataset) -> Dataset:
+    """
+    Copy of results whose lists of values can be changed without changing the ones of results
+    """
+    return OrderedDict((run, {t: list(v) if v is not None else None for t, v in r.items()} if r is not None else None)
+                       for run, r in results.items())
+
+
+def results_size(results: Dataset) -> int:
+    """
+    Estimation of the memory used by results, counting the dictionaries, the lists and a float object per value.
+    Runs are not counted, they are shared with the rest of the process.
+    """
+    float_size = sys.getsizeof(0.0)
+    size = sys.getsizeof(results)
+    for r in results.values():
+        if r is None:
+            continue
+        size += sys.getsizeof(r)
+        for v in r.values():
+            if v is not None:
+                size += sys.getsizeof(v) + float_size * len(v)
+    return size
+
+
+class ResultsCache:
+    """
+    Results loaded from the database, shared by all Build objects of the process.
+    Entries are keyed by the path of the results and the modification time of its files,
+    so a file changed on disk is never served from the cache. The cache is bounded by the estimated memory
+    used by the parsed results it holds, least recently used entries are evicted first.
+    The cache keeps its own copy of the results, so callers may change the results they get or put, like
+    the results of an older version reused with --use-last. Those copies are not counted in the bound.
+    """
+    def __init__(self, max_bytes = 1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() #filename -> (stamp, size, results)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _stamp(filename):
+        stamp = []
+        for f in [filename, filename + JOURNAL_EXT, filename + COLUMNAR_EXT + '/runs.json']:
+            try:
+                st = os.stat(f)
+            except OSError:
+                stamp.append(None)
+                continue
+            stamp.append((st.st_mtime_ns, st.st_size))
+        return tuple(stamp)
+
+    def _limit(self):
+        if npf.options and getattr(npf.options, "result_cache_size", None) is not None:
+            return npf.options.result_cache_size * 1024 * 1024
+        return self.max_bytes
+
+    def get(self, filename, count = True):
+        stamp = self._stamp(filename)
+        with self._lock:
+            entry = self._entries.get(filename, None)
+            if entry is not None and entry[0] == stamp:
+                self._entries.move_to_end(filename)
+                if count:
+                    self.hits += 1
+                return copy_results(entry[2])
+            if count:
+                self.misses += 1
+            return None
+
+    def put(self, filename, results):
+        stamp = self._stamp(filename)
+        results = copy_results(results)
+        with self._lock:
+            self._insert(filename, stamp, results_size(results), results)
+
+    def journal(self, filename, stamp_before, results):
+        """
+        Add results, just appended to the journal of filename, to the cached results of filename if they
+        were cached when the files had the stamp stamp_before
+        """
+        stamp = self._stamp(filename)
+        results = copy_results(results)
+        with self._lock:
+            entry = self._entries.get(filename, None)
+            if entry is None or entry[0] != stamp_before:
+                self.discard(filename, lock=False)
+                return
+            entry[2].update(results)
+            #Runs done again are counted twice until the entry is put again, keeping an upper bound
+            self._insert(filename, stamp, entry[1] + results_size(results), entry[2])
+
+    def _insert(self, filename, stamp, size, results):
+        self.discard(filename, lock=False)
+        if size > self._limit():
+            return
+        self._entries[filename] = (stamp, size, results)
+        self.bytes += size
+        while self.bytes > self._limit():
+            _, (_, esize, _) = self._entries.popitem(last=False)
+            self.bytes -= esize
+
+    def discard(self, filename, lock = True):
+        if lock:
+            self._lock.acquire()
+        entry = self._entries.pop(filename, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+        if lock:
+            self._lock.release()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __str__(self):
+        return "%d results cached (%d bytes), %d hits, %d misses" % (len(self), self.bytes, self.hits, self.misses)
+
+
 class Build:
+    #Results cache shared by all builds
+    cache = ResultsCache()
+
     def __init__(self, repo, version, result_path=None):
         self.n_tests = 0
         self.n_passed = 0
@@ -36,7 +177,6 @@ class Build:
         self._pretty_name = None
         self._marker = '.'
         self._line = '-'
-        self.cache = {}
         self._result_path = result_path
 
     def copy(self):
@@ -76,86 +216,279 @@ class Build:
     def __repr__(self):
         return "Build(repo=" + str(self.repo) + ", version=" + self.pretty_name() + ")"
 
-    def __resultFilename(self, script=None):
+    def __resultFilename(self, script=None, shard=None):
         if script:
-            return self.result_folder() + self.version + '/' + script.filename + ".results"
+            return self.result_folder() + self.version + '/' + script.filename + (".shard%d-%d" % shard if shard else "") + ".results"
         else:
             return self.result_folder() + self.version + '.results'
 
-    def writeversion(self, test, all_results: Dataset, allow_overwrite: bool = False, kind = False, reload=True):
+    def writeversion(self, test, all_results: Dataset, allow_overwrite: bool = False, kind = False, reload=True, shard=None):
         if not reload and all_results:
-          prev=self.load_results(test = test, kind = kind, cache=True)
+          prev=self.load_results(test = test, kind = kind, cache=True, shard=shard)
           if prev and len(all_results) < len(prev):
             print("ERROR ! Have less results than before. Forcing update write !")
             reload = True
             return
         if reload:
-            results = self.load_results(test = test, kind = kind, cache=False)
+            results = self.load_results(test = test, kind = kind, cache=False, shard=shard)
             if results:
                 results.update(all_results)
                 all_results = results
 
         if kind:
             for kind, kresult in all_results.items():
-                filename = self.__resultFilename(test) + '-' + kind
+                filename = self.__resultFilename(test, shard) + '-' + kind
                 self._writeversion(filename, kresult, allow_overwrite)
         else:
-            filename = self.__resultFilename(test)
+            filename = self.__resultFilename(test, shard)
             self._writeversion(filename, all_results, allow_overwrite)
 
-    def _writeversion(self, filename, all_results, allow_overwrite):
+    def journalversion(self, test, results: Dataset, kind = False, shard = None):
+        """
+        Append the given runs to the results journal of the test, without rewriting the results file.
+        The journal is replayed over the results file by load_results, and compacted back into the
+        results file once it grows larger than it.
+
+        :param results: The runs to record, or a dict kind->runs if kind is True
+        :param shard: The shard (i, N) whose results file is written, None for the results file of the test
+        """
+        if kind:
+            for kind, kresult in results.items():
+                filename = self.__resultFilename(test, shard) + '-' + kind
+                self._journal(filename, kresult)
+        else:
+            filename = self.__resultFilename(test, shard)
+            self._journal(filename, results)
+
+    def compact(self, test, kind = False, shard = None):
+        """
+        Merge the journal of the test back into its results file
+        """
+        if kind:
+            filename = self.__resultFilename(test, shard) + '-'
+            for kind in self._kinds(filename):
+                self._compact(filename + kind)
+        else:
+            self._compact(self.__resultFilename(test, shard))
+
+    def merge_shards(self, test):
+        """
+        Merge the results written by all the shards of test into the results of the test, and remove the
+        results files of the shards so a later merge does not overwrite runs done since
+
+        :return: The number of shards that were merged
+        """
+        folder = self.result_folder() + self.version + '/'
+        shards = set()
+        if os.path.exists(folder):
+            for f in os.listdir(folder):
+                m = re.match(re.escape(test.filename) + r"\.shard([0-9]+)-([0-9]+)\.results", f)
+                if m:
+                    shards.add((int(m.group(1)), int(m.group(2))))
+        if not shards:
+            return 0
+
+        results = OrderedDict()
+        kind_results = OrderedDict()
+        shard_files = []
+        for shard in sorted(shards):
+            filename = self.__resultFilename(test, shard)
+            shard_files.append(filename)
+            r = self._load_results(filename, cache=True)
+            if r:
+                results.update(r)
+            for kind in self._kinds(filename + '-'):
+                shard_files.append(filename + '-' + kind)
+                r = self._load_results(filename + '-' + kind, cache=True)
+                if r:
+                    kind_results.setdefault(kind, OrderedDict()).update(r)
+
+        filename = self.__resultFilename(test)
+        self._merge(filename, results)
+        for kind, kresults in kind_results.items():
+            self._merge(filename + '-' + kind, kresults)
+        for f in shard_files:
+            self._remove(f)
+        return len(shards)
+
+    def _remove(self, filename):
+        """
+        Delete the results file filename in all formats, with its journal
+        """
+        for f in [filename, filename + JOURNAL_EXT]:
+            if os.path.exists(f):
+                os.unlink(f)
+        if os.path.exists(filename + COLUMNAR_EXT):
+            shutil.rmtree(filename + COLUMNAR_EXT)
+        self.cache.discard(filename)
+
+    def _merge(self, filename, results):
+        all_results = self._load_results(filename, cache=False)
+        if all_results:
+            all_results.update(results)
+        else:
+            all_results = results
+        self._writeversion(filename, all_results, allow_overwrite=True)
+
+    @staticmethod
+    def _format_line(run, results):
+        v = []
+        for key, val in sorted(run.read_variables().items()):
+            if type(val) is tuple:
+                val = val[1]
+            v.append((key + ":" + str(val).replace('\\:', ':').replace(':','\\:')).replace('\\,', ',').replace(',','\\,'))
+        type_results = []
+        for t,r in results.items():
+            str_results = []
+            if r is None:
+                pass
+            else:
+                for val in r:
+                    if type(val) is list:
+                        str_results.extend([str(v) for v in val])
+                    else:
+                        str_results.append(str(val))
+            type_results.append(t+':'+(','.join(str_results)))
+        return ','.join(v) + "={" + '},{'.join(type_results) + "}\n"
+
+    @staticmethod
+    def _parse_line(line):
+        variables_data, results_data = line.strip().split('=')
+
+        variables = OrderedDict()
+
+        for v_data in re.split(r'(?<!\\),', variables_data):
+            if v_data.strip():
+                k, v = re.split(r'(?<!\\):', v_data)
+                variables[k] = variable.get_numeric(v) if variable.is_numeric(k) else str(v).replace('\\:',':')
+        results = {}
+
+        results_data = results_data.strip()[1:-1].split('},{')
+        if len(results_data) == 1 and results_data[0].strip() == '':
+            pass
+        else:
+            for type_r, results_type_data in [x.split(':') for x in results_data]:
+                results_type_data = results_type_data.split(',')
+                if len(results_type_data) == 1 and results_type_data[0].strip() == '':
+                    type_results = None
+                else:
+                    type_results = []
+                    for result in results_type_data:
+                        type_results.append(float(result.strip()))
+                results[type_r] = type_results
+        return Run(variables), results
+
+    @staticmethod
+    def _result_format():
+        return getattr(npf.options, "result_format", "text") if npf.options else "text"
+
+    @staticmethod
+    def _use_columnar(filename):
+        """
+        Tells if the results of filename are in the columnar format. Writing a format removes the other one,
+        both only remain if a columnar write was interrupted before removing the text file, which is then older
+        """
+        return has_columnar(filename + COLUMNAR_EXT)
+
+    @staticmethod
+    def _recover(filename):
+        """
+        Finish a write of the text file of filename interrupted once the new file was complete,
+        removing the columnar copy and moving the new file in place
+        """
+        if os.path.exists(filename + NEW_EXT):
+            if os.path.exists(filename + COLUMNAR_EXT):
+                shutil.rmtree(filename + COLUMNAR_EXT)
+            os.rename(filename + NEW_EXT, filename)
+
+    @staticmethod
+    def _base_size(filename):
+        if Build._use_columnar(filename):
+            return sum(f.stat().st_size for f in Path(filename + COLUMNAR_EXT).iterdir())
+        return os.path.getsize(filename) if os.path.exists(filename) else 0
+
+    @staticmethod
+    def _makedirs(filename):
         try:
             if not os.path.exists(os.path.dirname(filename)):
                 os.makedirs(os.path.dirname(filename))
         except OSError:
             print("Error : could not create %s" % os.path.dirname(filename))
-        if not allow_overwrite and os.path.exists(filename):
+
+    def _writeversion(self, filename, all_results, allow_overwrite):
+        self._makedirs(filename)
+        if not allow_overwrite and (os.path.exists(filename) or has_columnar(filename + COLUMNAR_EXT)):
             raise Exception("I refuse to overwrite %s" % filename)
-        f = open(filename, 'w+')
-        f.seek(0)
-        for run, results in all_results.items():
-            v = []
-            for key, val in sorted(run.read_variables().items()):
-                if type(val) is tuple:
-                    val = val[1]
-                v.append((key + ":" + str(val).replace('\\:', ':').replace(':','\\:')).replace('\\,', ',').replace(',','\\,'))
-            type_results = []
-            for t,r in results.items():
-                str_results = []
-                if r is None:
-                    pass
-                else:
-                    for val in r:
-                        if type(val) is list:
-                            str_results.extend([str(v) for v in val])
-                        else:
-                            str_results.append(str(val))
-                type_results.append(t+':'+(','.join(str_results)))
-            f.write(','.join(v) + "={" + '},{'.join(type_results) + "}\n")
-        f.close()
-        self.cache[filename] = all_results
+        if self._result_format() == "columnar":
+            write_columnar(filename + COLUMNAR_EXT, all_results)
+            if os.path.exists(filename):
+                os.unlink(filename)
+        else:
+            #Written aside, the columnar copy is removed only once the new file is complete
+            f = open(filename + TMP_EXT, 'w+')
+            f.seek(0)
+            for run, results in all_results.items():
+                f.write(self._format_line(run, results))
+            f.close()
+            os.rename(filename + TMP_EXT, filename + NEW_EXT)
+            self._recover(filename)
+        #The file now holds everything the journal had
+        if os.path.exists(filename + JOURNAL_EXT):
+            os.unlink(filename + JOURNAL_EXT)
+        self.cache.put(filename, all_results)
+
+    def _journal(self, filename, results):
+        if not results:
+            return
+        self._makedirs(filename)
+        stamp_before = self.cache._stamp(filename)
+        with open(filename + JOURNAL_EXT, 'a') as f:
+            for run, run_results in results.items():
+                f.write(self._format_line(run, run_results))
+        self.cache.journal(filename, stamp_before, results)
+
+        #Amortize the rewrite of the results file over as many appends as it has lines
+        journal_size = os.path.getsize(filename + JOURNAL_EXT)
+        if journal_size > JOURNAL_MIN_COMPACT and journal_size > self._base_size(filename):
+            self._compact(filename)
+
+    def _compact(self, filename):
+        if not os.path.exists(filename + JOURNAL_EXT):
+            return
+        all_results = self._load_results(filename, cache=False)
+        self._writeversion(filename, all_results, allow_overwrite=True)
 
+    @staticmethod
+    def _kinds(filename):
+        kinds = []
+        if os.path.exists(os.path.dirname(filename)):
+            for f in os.listdir(os.path.dirname(filename)):
+                if os.path.basename(filename) in f and not f.endswith((TMP_EXT, NEW_EXT)):
+                    for ext in [JOURNAL_EXT, COLUMNAR_EXT]:
+                        if f.endswith(ext):
+                            f = f[:-len(ext)]
+                    kind = f[f.rfind("-") + 1 :]
+                    if kind not in kinds:
+                        kinds.append(kind)
+        return kinds
 
-    def load_results(self, test, kind=False, cache=True):
+    def load_results(self, test, kind=False, cache=True, shard=None):
         if kind:
             kr={}
-            filename = self.__resultFilename(test) + '-'
-            if os.path.exists(os.path.dirname(filename)):
-              for f in os.listdir(os.path.dirname(filename)):
-                if os.path.basename(filename) in f:
-                    kind = f[f.rfind("-") + 1 :]
-                    f = filename + kind
-                    kr[kind] = self._load_results(f, cache)
+            filename = self.__resultFilename(test, shard) + '-'
+            for kind in self._kinds(filename):
+                kr[kind] = self._load_results(filename + kind, cache)
             return kr
 
         else:
-            filename = self.__resultFilename(test)
+            filename = self.__resultFilename(test, shard)
             return self._load_results(filename, cache)
 
     def _load_results(self, filename, cache):
         """
         The function `_load_results` reads data from a file, parses it, and returns the results in a
-        dictionary format.
+        dictionary format. Runs appended to the journal of the file since the last compaction are
+        replayed over it.
 
         :param filename: The `filename` parameter is a string that represents the name of the file from
         which the results will be loaded
@@ -166,50 +499,51 @@ class Build:
         :return: the variable "all_results", which is a dictionary containing the parsed results from
         the file.
         """
-        if not Path(filename).exists():
+        if not self._has_results(filename):
             return None
         if cache:
-            if filename in self.cache:
-                return self.cache[filename]
-        f = open(filename, 'r')
-        all_results = OrderedDict()
-        try:
-            for iline,line in enumerate(f):
-                if not line.strip():
-                    continue
-                variables_data, results_data = line.strip().split('=')
-
-                variables = OrderedDict()
-
-                for v_data in re.split(r'(?<!\\),', variables_data):
-                    if v_data.strip():
-                        k, v = re.split(r'(?<!\\):', v_data)
-                        variables[k] = variable.get_numeric(v) if variable.is_numeric(k) else str(v).replace('\\:',':')
-                results = {}
-
-                results_data = results_data.strip()[1:-1].split('},{')
-                if len(results_data) == 1 and results_data[0].strip() == '':
-                    pass
-                else:
-                    for type_r, results_type_data in [x.split(':') for x in results_data]:
-                        results_type_data = results_type_data.split(',')
-                        if len(results_type_data) == 1 and results_type_data[0].strip() == '':
-                            type_results = None
-                        else:
-                            type_results = []
-                            for result in results_type_data:
-                                type_results.append(float(result.strip()))
-                        results[type_r] = type_results
-                all_results[Run(variables)] = results
-        except:
-            print("Could not parse %s. The program will stop to avoid erasing data. Please correct or delete the file.\nLine %d : %s\n" % (filename,iline, line))
-            raise
-        f.close()
-        self.cache[filename] = all_results
+            cached = self.cache.get(filename)
+            if cached is not None:
+                return cached
+        if self._use_columnar(filename):
+            all_results = read_columnar(filename + COLUMNAR_EXT).to_dataset()
+            files = [(filename + JOURNAL_EXT, True)]
+        else:
+            all_results = OrderedDict()
+            files = [(filename, False), (filename + JOURNAL_EXT, True)]
+        for fname, journal in files:
+            if not Path(fname).exists():
+                continue
+            f = open(fname, 'r')
+            try:
+                for iline,line in enumerate(f):
+                    if not line.strip():
+                        continue
+                    if journal and not line.endswith('\n'):
+                        print("WARNING: Ignoring the last run of %s, it was not completely written" % fname)
+                        continue
+                    run, results = self._parse_line(line)
+                    all_results[run] = results
+            except:
+                print("Could not parse %s. The program will stop to avoid erasing data. Please correct or delete the file.\nLine %d : %s\n" % (fname,iline, line))
+                raise
+            f.close()
+        self.cache.put(filename, all_results)
         return all_results
 
+    def results_stamp(self, test):
+        """
+        Modification times and sizes of the files holding the results of test, that change when they are written
+        """
+        return self.cache._stamp(self.__resultFilename(test))
+
+    @staticmethod
+    def _has_results(filename):
+        Build._recover(filename)
+        return os.path.exists(filename) or os.path.exists(filename + JOURNAL_EXT) or has_columnar(filename + COLUMNAR_EXT)
+
     def hasResults(self, script=None):
-        return os.path.exists(self.__resultFilename(script))
+        return self._has_results(self.__resultFilename(script))
 
     def writeResults(self):
         filename = self.__resultFilename()
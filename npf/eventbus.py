@@ -1,7 +1,64 @@
 import multiprocessing
 import os
+import threading
 
 class EventBus:
+    """
+    Events posted by the scripts of a run and termination of the run, shared between the threads running the scripts.
+    Use ManagerEventBus if the scripts run in other processes.
+    """
+    def __init__(self):
+        self.c = threading.Condition()
+        self.events = set()
+        self.terminated = threading.Event()
+        self.wakeups = {}
+
+    def post(self, ev):
+        with self.c:
+            self.events.add(ev)
+            self.c.notify_all()
+
+    def terminate(self):
+        with self.c:
+            self.terminated.set()
+            self.c.notify_all()
+            for w in self.wakeups.values():
+                os.write(w, b'\0')
+
+    def wakeup_fd(self):
+        """
+        Return a file descriptor that becomes readable when the bus is terminated, so it can be waited on
+        with select along with other files. It must be given back with release_fd.
+        """
+        r, w = os.pipe()
+        with self.c:
+            self.wakeups[r] = w
+            if self.terminated.is_set():
+                os.write(w, b'\0')
+        return r
+
+    def release_fd(self, r):
+        with self.c:
+            w = self.wakeups.pop(r)
+        os.close(r)
+        os.close(w)
+
+    def wait_for_termination(self, t):
+        with self.c:
+            self.c.wait_for(self.terminated.is_set, timeout=t)
+
+    def is_terminated(self):
+        return self.terminated.is_set()
+
+    def listen(self, ev):
+        with self.c:
+            self.c.wait_for(lambda: ev in self.events or self.terminated.is_set())
+
+
+class ManagerEventBus:
+    """
+    Same as EventBus but backed by a multiprocessing manager, so it can be shared between processes
+    """
     def __init__(self, m = None):
         if not m:
             m = multiprocessing.Manager()
@@ -21,7 +21,7 @@ class EnoslibExecutor(Executor):
     def exec(self, cmd : str, bin_paths : List[str]=[],
              queue: Queue = None, options = None,
              stdin = None, timeout = None, sudo = False,
-             testdir = None, event = None, title = None, env = {}, virt = "" ,
+             testdir = None, event = None, title = None, env = {}, virt = "" , sink = None,
         ) -> [int, str, str, int]:
         """Runs a command in local
 
@@ -38,9 +38,10 @@ class EnoslibExecutor(Executor):
             title (_type_, optional): Title for the script. Defaults to None.
             env (dict, optional): Env array. Defaults to {}.
             virt (str, optional): Virtualisation decorator (eg namespaces). Defaults to "".
+            sink (callable, optional): Called with the channel (0 for stdout, 1 for stderr) and each line of output, instead of keeping the output. Defaults to None.
 
         Returns:
-            [int, str, str, int]: pid, stdout, stderr, return code
+            [int, str, str, int]: pid, stdout, stderr (empty with a sink), return code
         """
         if testdir:
             cmd = "mkdir -p " + testdir + " && cd " + testdir + ";\n" + cmd;
@@ -81,6 +82,12 @@ class EnoslibExecutor(Executor):
             if options and not options.quiet:
                 self._print(title, line.rstrip(), True)
 
+        if sink:
+            for ichannel, out in enumerate([p.stdout, p.stderr]):
+                for line in out.splitlines(keepends=True):
+                    sink(ichannel, line)
+            return p.status, '', '', p.rc
+
         return p.status, p.stdout, p.stderr, p.rc
 
     def writeFile(self,filename,path_to_root,content,sudo=False):
@@ -88,3 +95,15 @@ class EnoslibExecutor(Executor):
             a.copy(dest=filename, content=content)
 
         return True
+
+    def writeFiles(self, files, path_to_root, sudo=False, skip_unchanged=False):
+        if skip_unchanged:
+            files = self._changed_files(files, path_to_root)
+            if not files:
+                return True
+        with en.actions(roles=self.machine) as a:
+            for filename, content in files:
+                a.copy(dest=filename, content=content)
+
+        self._remember_files(files, path_to_root)
+        return True
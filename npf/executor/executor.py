@@ -1,9 +1,43 @@
+import hashlib
 import re
+from typing import List
 
 from colorama import Fore, Back, Style
 
 foreColors = [Fore.BLACK, Fore.RED, Fore.GREEN, Fore.YELLOW, Fore.BLUE, Fore.MAGENTA, Fore.CYAN, Fore.WHITE]
 
+class LineBuffer:
+    """
+    Split a stream received by chunks into lines. Bytes are accumulated until a line is complete, so lines
+    and multi-byte characters cut between two chunks are decoded only once, and only the newly received
+    bytes are searched for the end of a line.
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data) -> List[str]:
+        """
+        Add data to the buffer and return the lines completed, with their new line character
+        """
+        start = len(self.buffer)
+        self.buffer += data
+        end = self.buffer.rfind(b'\n', start)
+        if end == -1:
+            return []
+        lines = self.buffer[:end + 1].decode("utf-8", errors="replace").split('\n')
+        del self.buffer[:end + 1]
+        lines.pop()
+        return [line + '\n' for line in lines]
+
+    def flush(self) -> str:
+        """
+        Return the last, unterminated line
+        """
+        rest = self.buffer.decode("utf-8", errors="replace")
+        self.buffer.clear()
+        return rest
+
+
 class Executor:
 
     index = 0
@@ -16,6 +50,42 @@ class Executor:
             self.color = ""
         Executor.index = Executor.index + 1
         self.path = None
+        self.file_hashes = {}
+        self.bytes_saved = 0
+
+    def writeFiles(self, files, path_to_root, sudo=False, skip_unchanged=False):
+        """
+        Write all the files of a run, given as a list of (filename, content). Executors for which every
+        write has a cost should send them all at once.
+
+        :param skip_unchanged: Do not write again files with the same content as the last time this
+                               executor wrote them. Only valid if nothing else deletes or changes them.
+        """
+        if skip_unchanged:
+            files = self._changed_files(files, path_to_root)
+        for filename, content in files:
+            if not self.writeFile(filename, path_to_root, content, sudo=sudo):
+                return False
+        self._remember_files(files, path_to_root)
+        return True
+
+    def _changed_files(self, files, path_to_root):
+        """
+        Return the files whose content differs from the last one written at the same path,
+        counting the size of the others in bytes_saved
+        """
+        changed = []
+        for filename, content in files:
+            data = content.encode()
+            if self.file_hashes.get((path_to_root, filename), None) == hashlib.sha256(data).digest():
+                self.bytes_saved += len(data)
+            else:
+                changed.append((filename, content))
+        return changed
+
+    def _remember_files(self, files, path_to_root):
+        for filename, content in files:
+            self.file_hashes[(path_to_root, filename)] = hashlib.sha256(content.encode()).digest()
 
     def searchEvent(self, output, eb):
         results = re.finditer("EVENT ([a-zA-Z_-]+)", output)
@@ -1,13 +1,35 @@
 import os
 import pwd
+import codecs
+import selectors
 import signal
-import select
+import time
 from multiprocessing import Queue, Event
 from subprocess import PIPE, Popen, TimeoutExpired
 from typing import List
 from .executor import Executor
 from pathlib import Path
 
+#Without pidfd or a wake-up file from the event bus, the exit of the process and the termination
+# of the run are checked at this interval
+FALLBACK_STEP = 0.05
+
+EXITED = 'exited'
+TERMINATED = 'terminated'
+
+
+def _pidfd_open(pid):
+    """
+    Return a file descriptor that becomes readable when the process exits, or None if not supported
+    """
+    if not hasattr(os, 'pidfd_open'):
+        return None
+    try:
+        return os.pidfd_open(pid)
+    except OSError:
+        return None
+
+
 class LocalKiller:
     def __init__(self, pgpid):
         self.pgpid = pgpid
@@ -34,7 +56,7 @@ class LocalExecutor(Executor):
     def exec(self, cmd : str, bin_paths : List[str]=[],
              queue: Queue = None, options = None,
              stdin = None, timeout = None, sudo = False,
-             testdir=None, event=None, title=None, env = {}, virt="" ,
+             testdir=None, event=None, title=None, env = {}, virt="" , sink=None,
         ) -> [int, str, str, int]:
         """Runs a command in local
 
@@ -51,9 +73,10 @@ class LocalExecutor(Executor):
             title (_type_, optional): Title for the script. Defaults to None.
             env (dict, optional): Env array. Defaults to {}.
             virt (str, optional): Virtualisation decorator (eg namespaces). Defaults to "".
+            sink (callable, optional): Called with the channel (0 for stdout, 1 for stderr) and each line of output, instead of keeping the output. Defaults to None.
 
         Returns:
-            [int, str, str, int]: pid, stdout, stderr, return code
+            [int, str, str, int]: pid, stdout, stderr (empty with a sink), return code
         """
 
         if not title:
@@ -82,42 +105,100 @@ class LocalExecutor(Executor):
                   shell=True, preexec_fn=os.setsid,
                   env=env)
 
-        select_set = select.poll()
-        select_set.register(p.stdout,select.POLLIN)
-        select_set.register(p.stderr,select.POLLIN)
-        os.set_blocking(p.stdout.fileno(), False)
-        os.set_blocking(p.stderr.fileno(), False)
         pid = p.pid
         pgpid = os.getpgid(pid)
-        flushing = False
 
-        step = 0.2
         killer = LocalKiller(pgpid)
         if queue:
             queue.put(killer)
-        try:
-            while True:
-                select_set.poll(step * 1000)
-                for ichannel, channel in enumerate([p.stdout,p.stderr]):
-                    for line in channel.readlines():
-                        line = line.decode()
-                        outputs[ichannel] += line
-                        self.searchEvent(line, event)
-                        if options and not options.quiet:
-                            self._print(title, line.rstrip(), True)
-
-                #When the program is closed, do one last turn
-                if p.poll() is not None or (event and event.is_terminated()):
-                    if flushing:
-                        break
-                    else:
-                        flushing = True
 
+        #Wait for output, for the exit of the process and for the termination of the run all at once,
+        # instead of polling at regular interval
+        sel = selectors.DefaultSelector()
+        decoders = []
+        partial = ['', '']
+        for ichannel, channel in enumerate([p.stdout, p.stderr]):
+            os.set_blocking(channel.fileno(), False)
+            sel.register(channel, selectors.EVENT_READ, ichannel)
+            decoders.append(codecs.getincrementaldecoder('utf-8')(errors='replace'))
+        pidfd = _pidfd_open(pid)
+        if pidfd is not None:
+            sel.register(pidfd, selectors.EVENT_READ, EXITED)
+        wakefd = event.wakeup_fd() if event is not None and hasattr(event, 'wakeup_fd') else None
+        if wakefd is not None:
+            sel.register(wakefd, selectors.EVENT_READ, TERMINATED)
+
+        def read(channel, ichannel):
+            """
+            Handle the complete lines available on channel, return False if there was nothing to read
+            """
+            try:
+                data = os.read(channel.fileno(), 65536)
+            except BlockingIOError:
+                return False
+            if not data:
+                partial[ichannel] += decoders[ichannel].decode(b'', final=True)
+                sel.unregister(channel)
+                return False
+            lines = (partial[ichannel] + decoders[ichannel].decode(data)).split('\n')
+            partial[ichannel] = lines.pop()
+            for line in lines:
+                line = line + '\n'
+                if sink:
+                    sink(ichannel, line)
+                else:
+                    outputs[ichannel] += line
+                self.searchEvent(line, event)
+                if options and not options.quiet:
+                    self._print(title, line.rstrip(), True)
+            return True
 
-                if timeout is not None:
-                    timeout -= step
-                    if timeout < 0:
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        try:
+            done = False
+            while not done:
+                if deadline is not None:
+                    wait = deadline - time.monotonic()
+                    if wait < 0:
                         raise TimeoutExpired(cmd, timeout)
+                else:
+                    wait = None
+                #Poll only if the exit of the process or a termination of the event could not wake select
+                if pidfd is None or (event is not None and wakefd is None):
+                    wait = FALLBACK_STEP if wait is None else min(wait, FALLBACK_STEP)
+
+                for key, mask in sel.select(wait):
+                    if key.data in (0, 1):
+                        read(key.fileobj, key.data)
+                    else:
+                        done = True
+
+                if p.poll() is not None or (event and event.is_terminated()):
+                    done = True
+
+            if p.poll() is None:
+                #The run was terminated, the script is killed now and reaped, else it stays a zombie that
+                # killall sees alive until its timeout
+                try:
+                    os.killpg(pgpid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                p.wait()
+
+            #Read what was written before the end, without waiting for children that may keep the pipes open
+            for ichannel, channel in enumerate([p.stdout, p.stderr]):
+                if channel in sel.get_map():
+                    while read(channel, ichannel):
+                        pass
+                if partial[ichannel]:
+                    if sink:
+                        sink(ichannel, partial[ichannel])
+                    else:
+                        outputs[ichannel] += partial[ichannel]
+                    self.searchEvent(partial[ichannel], event)
+                    if options and not options.quiet:
+                        self._print(title, partial[ichannel].rstrip(), True)
+                    partial[ichannel] = ''
 
             p.stdin.close()
             p.stderr.close()
@@ -128,8 +209,11 @@ class LocalExecutor(Executor):
             print("Test expired")
             p.terminate()
             p.kill()
-            os.killpg(pgpid, signal.SIGKILL)
-            os.killpg(pgpid, signal.SIGTERM)
+            try:
+                os.killpg(pgpid, signal.SIGKILL)
+                os.killpg(pgpid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
             p.stdin.close()
             p.stderr.close()
             p.stdout.close()
@@ -139,9 +223,21 @@ class LocalExecutor(Executor):
             os.killpg(pgpid, signal.SIGKILL)
 
             return -1, outputs[0], outputs[1], p.returncode
+        finally:
+            sel.close()
+            if pidfd is not None:
+                os.close(pidfd)
+            if wakefd is not None:
+                event.release_fd(wakefd)
 
     def writeFile(self,filename,path_to_root,content,sudo=False):
         f = open(filename, "w")
         f.write(content)
         f.close()
         return True
+
+    def writeFiles(self, files, path_to_root, sudo=False, skip_unchanged=False):
+        #Files are always written, it is as cheap as checking them
+        for filename, content in files:
+            self.writeFile(filename, path_to_root, content, sudo=sudo)
+        return True
@@ -1,5 +1,9 @@
+import hashlib
+import io
 import multiprocessing
+import multiprocessing.pool
 import os,errno
+import tarfile
 import time
 from multiprocessing import Queue
 from typing import List
@@ -8,12 +12,187 @@ from cryptography.utils import CryptographyDeprecationWarning
 with warnings.catch_warnings():
     warnings.filterwarnings('ignore', category=CryptographyDeprecationWarning)
     import paramiko
-from .executor import Executor
+from .executor import Executor, LineBuffer
 from ..eventbus import EventBus
 from .. import npf
-from paramiko.buffered_pipe import PipeTimeout
+import select
+import shlex
 import socket
 import stat
+import threading
+from contextlib import contextmanager
+
+#Read the output of scripts by chunks of this size
+RECV_SIZE = 65536
+
+#Number of SFTP sessions sending the files of a folder at once
+SEND_WORKERS = 8
+
+#Folders never sent by sendFolder
+IGNORED_FOLDERS = ['.git', '.vimhistory']
+
+
+def _local_manifest(root):
+    """
+    List the files under root with their size, modification time and mode, and the folders
+    """
+    files = {}
+    dirs = []
+    for dirpath, dirnames, filenames in os.walk(root, followlinks=True):
+        dirnames[:] = [d for d in dirnames if d not in IGNORED_FOLDERS]
+        rel = os.path.relpath(dirpath, root)
+        rel = '' if rel == '.' else rel + '/'
+        dirs.extend(rel + d for d in dirnames)
+        for f in filenames:
+            try:
+                st = os.stat(os.path.join(dirpath, f))
+            except FileNotFoundError:
+                #Broken link
+                continue
+            files[rel + f] = (st.st_size, int(st.st_mtime), st.st_mode)
+    return files, dirs
+
+
+def _files_archive(files) -> bytes:
+    """
+    Tar archive of files, a list of (filename, content) where filename may be a relative path with folders
+    """
+    archive = io.BytesIO()
+    now = time.time()
+    with tarfile.open(fileobj=archive, mode='w') as tar:
+        for filename, content in files:
+            data = content.encode()
+            info = tarfile.TarInfo(filename)
+            info.size = len(data)
+            info.mode = 0o644
+            info.mtime = now
+            tar.addfile(info, io.BytesIO(data))
+    return archive.getvalue()
+
+
+def _local_file(lpath):
+    """
+    Folder of the single file lpath, and its manifest as given by _local_manifest
+    """
+    lroot, name = os.path.split(lpath)
+    st = os.stat(lpath)
+    return lroot or '.', {name: (st.st_size, int(st.st_mtime), st.st_mode)}
+
+
+def _parse_manifest(out):
+    """
+    Parse the output of the find command of SSHExecutor._remote_manifest, a line per file
+    (f, path, size, modification time) or folder (d, path) with tab-separated fields
+    """
+    files = {}
+    dirs = set()
+    for line in out.splitlines():
+        entry = line.split('\t')
+        if entry[0] == 'f' and len(entry) == 4:
+            files[entry[1]] = (int(entry[2]), int(float(entry[3])))
+        elif entry[0] == 'd' and len(entry) == 2:
+            dirs.add(entry[1])
+    return files, dirs
+
+
+def _plan_send(files, remote_files, same_content=None):
+    """
+    Decide which of the local files must be sent, given the manifest of the node.
+    Files missing on the node or of another size are sent, files of the same size and modification time are skipped.
+    Files of the same size but another time are sent, unless same_content is given : it is then called with their
+    names and returns those having the same content on the node, that are skipped too.
+
+    :return: The names to send, the names skipped whose modification time must be set on the node,
+             and the number of bytes skipped
+    """
+    to_send = []
+    same_size = []
+    skipped = 0
+    for name, (size, mtime, mode) in files.items():
+        r = remote_files.get(name, None)
+        if r is None or r[0] != size:
+            to_send.append(name)
+        elif r[1] == mtime:
+            skipped += size
+        else:
+            same_size.append(name)
+
+    touch = []
+    if same_size and same_content is not None:
+        same = set(same_content(same_size))
+        for name in same_size:
+            if name in same:
+                touch.append(name)
+                skipped += files[name][0]
+            else:
+                to_send.append(name)
+    else:
+        to_send.extend(same_size)
+    return to_send, touch, skipped
+
+
+class SSHPool:
+    """
+    Connections to a node, shared by all the scripts and transfers to that node. Each user takes as many
+    session slots as the channels it may have open at once on its connection, a new connection being made
+    only when none of them has enough free slots left out of max_sessions (sshd refuses more channels than
+    its MaxSessions, 10 by default).
+    Connections send keepalives, and the ones found dead are replaced.
+    """
+    def __init__(self, connect, max_sessions=8, keepalive=30):
+        self.connect = connect
+        self.max_sessions = max_sessions
+        self.keepalive = keepalive
+        self.lock = threading.Lock()
+        self.connections = [] #List of [ssh client, number of sessions in use, retired]
+
+    def acquire(self, sessions=1, new=False):
+        """
+        Take sessions slots on a connection. If new, the connection is a new one.
+        """
+        if not new:
+            with self.lock:
+                for c in list(self.connections):
+                    ssh, used, retired = c
+                    transport = ssh.get_transport()
+                    if transport is None or not transport.is_active():
+                        c[2] = True
+                    if c[2]:
+                        if c[1] == 0:
+                            self.connections.remove(c)
+                            ssh.close()
+                        continue
+                    if used + sessions <= self.max_sessions:
+                        c[1] += sessions
+                        return ssh
+        ssh = self.connect()
+        ssh.get_transport().set_keepalive(self.keepalive)
+        with self.lock:
+            self.connections.append([ssh, sessions, False])
+        return ssh
+
+    def release(self, ssh, dead=False, sessions=1):
+        """
+        Give back the slots taken with acquire. If dead, the connection will not be given again and is closed
+        as soon as it has no more users.
+        """
+        with self.lock:
+            for c in self.connections:
+                if c[0] is ssh:
+                    c[1] -= sessions
+                    if dead:
+                        c[2] = True
+                    if c[2] and c[1] == 0:
+                        self.connections.remove(c)
+                        ssh.close()
+                    break
+
+    def close(self):
+        with self.lock:
+            for c in self.connections:
+                c[0].close()
+            self.connections = []
+
 
 class SSHExecutor(Executor):
 
@@ -26,31 +205,50 @@ class SSHExecutor(Executor):
         else:
             self.path = path + '/'
         self.port = port
-        self.ssh = False
         self.unbuffer = True
         #Executor should not make any connection in init as parameters can be overwritten afterward
+        self.pool = SSHPool(self.get_connection)
 
     def __del__(self):
-        if self.ssh:
-            self.ssh.close()
+        self.pool.close()
 
-    def get_connection(self, cache=True):
-        import paramiko
-        if cache and self.ssh:
-            return self.ssh
+    def get_connection(self):
+        """
+        Open a new connection to the node. Use self.pool to get a shared one.
+        """
         ssh = paramiko.SSHClient()
         ssh.load_system_host_keys()
         ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
         ssh.connect(self.addr, username=self.user, port=self.port)
-        if cache:
-            self.ssh = ssh
         return ssh
 
+    def _exec_command(self, command):
+        """
+        Start command on a channel of a pooled connection, and return the connection with the streams of the command.
+        If the connection died since its last use or refused the channel, it is retried once on another connection.
+        """
+        ssh = self.pool.acquire()
+        new = False
+        try:
+            return (ssh,) + ssh.exec_command(command)
+        except paramiko.ssh_exception.ChannelException:
+            #The connection is fine but the node refused one more channel on it
+            self.pool.release(ssh)
+            new = True
+        except (paramiko.ssh_exception.SSHException, EOFError, socket.error):
+            self.pool.release(ssh, dead=True)
+        ssh = self.pool.acquire(new=new)
+        try:
+            return (ssh,) + ssh.exec_command(command)
+        except BaseException:
+            self.pool.release(ssh, dead=True)
+            raise
+
 
     def exec(self, cmd, bin_paths : List[str] = None,
              queue: Queue = None, options = None,
              stdin = None, timeout=None, sudo=False, testdir=None,
-             event=None, title=None, env={}, virt = "", raw = False):
+             event=None, title=None, env={}, virt = "", raw = False, sink = None):
         if testdir:
             cmd = "mkdir -p " + testdir + " && cd " + testdir + ";\n" + cmd;
         if not title:
@@ -97,122 +295,153 @@ class SSHExecutor(Executor):
 
         ssh = None
         try:
-            ssh = self.get_connection(cache=False)
-
             #First echo the pid of the shell, so it can be recovered and killed in case of kill from another script
             #Then launch the pre-command (goes to the right folder)
             #Then the user command, wrapped with sudo and/or bash if needed
-            ssh_stdin, ssh_stdout, ssh_stderr = ssh.exec_command("echo $$;"+ pre + cmd + " ; echo '' ;")
+            ssh, ssh_stdin, ssh_stdout, ssh_stderr = self._exec_command("echo $$;"+ pre + cmd + " ; echo '' ;")
             if stdin is not None:
                 ssh_stdin.write(stdin)
-            channels = [ssh_stdout, ssh_stderr]
-            output = ['','']
-            buffers = ['','']
+            chan = ssh_stdout.channel
+            #stdout and stderr are two streams of the same channel
+            receive = [chan.recv, chan.recv_stderr]
+            ready = [chan.recv_ready, chan.recv_stderr_ready]
+            readers = [LineBuffer(), LineBuffer()]
+            #Lines are joined at the end, growing a string for every line is quadratic
+            output = [[], []]
             rpid = -1
             pid = os.getpid()
             step = 0.2
-            #for channel in channels:
-            #   channel.channel.setblocking(False)
-
-            while (not event.is_terminated() and not ssh_stdout.channel.exit_status_ready()) or (ssh_stdout.channel.recv_ready() or ssh_stderr.channel.recv_ready()):
-                try:
-                    line = None
-                    for ichannel,channel in enumerate(channels):
-                        chan = channel.channel
-                        ichannel = 0
-                        if chan.recv_ready():
-                            try:
-                                data = chan.recv(1024)
-                                buffers[ichannel] = buffers[ichannel] + data.decode("utf-8")
-                                while "\n" in buffers[ichannel]:
-                                    p = buffers[ichannel].index("\n")
-                                    line = buffers[ichannel][:p+1]
-                                    buffers[ichannel] = buffers[ichannel][p+1:]
-                                    if rpid == -1:
-                                        rpid = int(line)
-                                    else:
-                                        if options and not options.quiet:
-                                            self._print(title, line, False)
-                                        self.searchEvent(line, event)
-                                        output[ichannel] += line
-                                    if buffers[ichannel]:
-                                        self.searchEvent(buffers[ichannel], event)
-                            except UnicodeDecodeError:
-                                        print("Could not decode SSH input")
-                            except Exception as e:
-                                print("Error")
-                                print(e)
-                                raise(e)
-
-                    else:
-                        event.wait_for_termination(step)
-                        if timeout is not None:
-                            timeout -= step
-                except PipeTimeout:
-                    pass
-                except socket.timeout:
-                    self._print(title, "Interrupted by timeout", True)
-                    event.wait_for_termination(step)
-                    if timeout is not None:
-                        timeout -= step
-                except KeyboardInterrupt:
-                    event.terminate()
-                    ssh.close()
-                    return -1, output[0], output[1], 0
-                if timeout is not None:
-                    if timeout < 0:
+            deadline = time.monotonic() + timeout if timeout is not None else None
+            wakefd = event.wakeup_fd() if hasattr(event, 'wakeup_fd') else None
+
+            def handle(ichannel, line):
+                nonlocal rpid
+                if ichannel == 0 and rpid == -1:
+                    rpid = int(line)
+                    return
+                if options and not options.quiet:
+                    self._print(title, line, False)
+                self.searchEvent(line, event)
+                if sink:
+                    sink(ichannel, line)
+                else:
+                    output[ichannel].append(line)
+
+            def read_available():
+                got = False
+                for ichannel in range(2):
+                    while ready[ichannel]():
+                        got = True
+                        for line in readers[ichannel].feed(receive[ichannel](RECV_SIZE)):
+                            handle(ichannel, line)
+                return got
+
+            try:
+                while True:
+                    got = read_available()
+                    if event.is_terminated():
+                        if not chan.closed:
+                            if options and options.debug:
+                                print("[DEBUG] %s: Sending SIGKILL to %d" % (title,rpid))
+                            chan.send(chr(3))
+                        self._kill(rpid)
+                        chan.status_event.wait(timeout=1)
+                        read_available()
+                        break
+                    if chan.exit_status_ready() and not got:
+                        read_available()
+                        break
+                    if deadline is not None and time.monotonic() > deadline:
                         event.terminate()
                         pid = 0
                         break
-                if event.is_terminated():
-                    if not ssh_stdin.channel.closed:
-
-                        if options and options.debug:
-                            print("[DEBUG] %s: Sending SIGKILL to %d" % (title,rpid))
-                        ssh_stdin.channel.send(chr(3))
-                    ssh.exec_command("kill "+str(rpid))
-#                   unneeded ssh.exec_command("kill $(ps -s  "+str(rpid)+" -o pid=)" )
-                    i=0
-                    ssh_stdout.channel.status_event.wait(timeout=1)
-                # end of loop
+                    if got:
+                        continue
+                    wait = step if deadline is None else max(0, min(step, deadline - time.monotonic()))
+                    if chan.eof_received:
+                        #The pipe of the channel stays readable after EOF, only the exit status is awaited
+                        chan.status_event.wait(timeout=wait)
+                    else:
+                        select.select([chan] + ([wakefd] if wakefd is not None else []), [], [], wait)
+            except KeyboardInterrupt:
+                event.terminate()
+                chan.close()
+                self.pool.release(ssh)
+                return -1, ''.join(output[0]), ''.join(output[1]), 0
+            finally:
+                if wakefd is not None:
+                    event.release_fd(wakefd)
+
+            for ichannel in range(2):
+                rest = readers[ichannel].flush()
+                if rest:
+                    handle(ichannel, rest)
 
             if event.is_terminated():
                 ret = 0 #Ignore return code because we kill it before completion.
             else:
-                ret = ssh_stdout.channel.recv_exit_status()
-            ssh.close()
+                ret = chan.recv_exit_status()
+            chan.close()
+            self.pool.release(ssh)
             ssh=None
 
-
-
-            return pid,output[0], output[1],ret
+            return pid, ''.join(output[0]), ''.join(output[1]), ret
         except socket.gaierror as e:
             print("Error while connecting to %s" % self.addr)
             print(e)
             if ssh:
-                ssh.close()
+                self.pool.release(ssh, dead=True)
             return 0,'','',-1
         except paramiko.ssh_exception.SSHException as e:
             print("Error while connecting to %s" % self.addr)
             print(e)
             if ssh:
-                    ssh.close()
+                self.pool.release(ssh, dead=True)
             return 0,'','',-1
 
+    def _kill(self, rpid):
+        """
+        Kill the remote process rpid, from a channel taking its own slot in the pool
+        """
+        try:
+            with self.connection() as ssh:
+                stdin, stdout, stderr = ssh.exec_command("kill " + str(rpid))
+                stdout.channel.recv_exit_status()
+                stdout.channel.close()
+        except (paramiko.ssh_exception.SSHException, EOFError, socket.error) as e:
+            print("WARNING: Could not kill process %d on %s : %s" % (rpid, self.addr, e))
+
+    @contextmanager
+    def connection(self, sessions=1):
+        """
+        A pooled connection, on which at most sessions channels are opened at once
+        """
+        try:
+            ssh = self.pool.acquire(sessions)
+        except Exception as e:
+            print("Cannot connect to %s with username %s" % (self.addr,self.user))
+            raise e
+        try:
+            yield ssh
+        except paramiko.ssh_exception.ChannelException:
+            self.pool.release(ssh, sessions=sessions)
+            raise
+        except (paramiko.ssh_exception.SSHException, EOFError, socket.error):
+            self.pool.release(ssh, dead=True, sessions=sessions)
+            raise
+        except BaseException:
+            self.pool.release(ssh, sessions=sessions)
+            raise
+        else:
+            self.pool.release(ssh, sessions=sessions)
+
     def writeFile(self,filename,path_to_root,content,sudo=False):
         f = open(filename, "w")
         f.write(content)
         f.close()
 
         try:
-            with paramiko.SSHClient() as ssh:
-                ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                ssh.load_system_host_keys()
-                try:
-                    ssh = self.get_connection()
-                except Exception as e:
-                    print("Cannot connect to %s with username %s" % (self.addr,self.user))
-                    raise e
+            with self.connection() as ssh:
 
                 transport = ssh.get_transport()
                 with transport.open_channel(kind='session') as channel:
@@ -229,122 +458,193 @@ class SSHExecutor(Executor):
             print("Error while connecting to %s" % self.addr)
             raise e
 
+    def writeFiles(self, files, path_to_root, sudo=False, skip_unchanged=False):
+        """
+        Write all files at once, as a tar archive extracted by a single command on the node.
+        The local copies are always written.
+        """
+        for filename, content in files:
+            with open(filename, "w") as f:
+                f.write(content)
+        if skip_unchanged:
+            files = self._changed_files(files, path_to_root)
+            if not files:
+                return True
+
+        archive = _files_archive(files)
+        root = '%s/%s' % (self.path, path_to_root)
+        try:
+            with self.connection() as ssh:
+                with ssh.get_transport().open_channel(kind='session') as channel:
+                    channel.exec_command(('sudo ' if sudo else '') + 'mkdir -p %s && ' % root + ('sudo ' if sudo else '') + 'tar -x -m --no-same-owner -f - -C %s' % root)
+                    channel.sendall(archive)
+                    channel.shutdown_write()
+                    if channel.recv_exit_status() != 0:
+                        print("Could not extract files in %s on %s!" % (root, self.addr))
+                        return False
+            self._remember_files(files, path_to_root)
+            return True
+        except paramiko.ssh_exception.SSHException as e:
+            print("Error while connecting to %s" % self.addr)
+            raise e
+
     def sendFolder(self, path, local = None):
-        sftp = None
+        """
+        Send the file or folder path, relative to local (or the current folder), to the same path in the NPF
+        folder of the node. Only the files missing on the node or with another size or modification time are
+        sent. With --send-checksum, files of the same size but another time are compared by content first.
+        Files are sent by several SFTP sessions at once and keep their mode and modification time.
+
+        :return: The number of bytes sent and the number of bytes already up to date
+        """
+        lpath = path if not local else local + os.sep + path
+        remote_path = self.path + path
         try:
-            with paramiko.SSHClient() as ssh:
-                ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                ssh.load_system_host_keys()
+            #The SFTP session stays open while the manifest and checksums are run on another channel
+            with self.connection(sessions=2) as ssh:
+                sftp = paramiko.SFTPClient.from_transport(ssh.get_transport())
                 try:
-                    ssh = self.get_connection()
-                except Exception as e:
-                    print("Cannot connect to %s with username %s" % (self.addr,self.user))
-                    raise e
-
-                transport = ssh.get_transport()
-
-                sftp = paramiko.SFTPClient.from_transport(transport)
-
-                ignored = ['.git', '.vimhistory']
-                def _send(path):
-                    total = 0
-                    skipped = 0
-                    try:
-                        rlist = sftp.listdir(self.path + path)
-                        lpath = path if not local else local + os.sep + path
-                        for entry in os.scandir(lpath):
-                            if entry.is_file():
-                                remote = self.path + path + '/' + entry.name
-                                if not entry.name in rlist or entry.stat().st_size != sftp.stat(remote).st_size:
-                                    try:
-                                        es = entry.stat()
-                                        sftp.put(lpath + '/' + entry.name, remote)
-                                        sftp.chmod(remote, es.st_mode)
-                                        total += es.st_size
-                                    except FileNotFoundError:
-                                        sftp.close()
-                                        raise(Exception("Could not send %s to %s"  % (path + '/' + entry.name, remote)))
-                                else:
-                                    skipped += entry.stat().st_size
-                            else:
-                                if entry.name in ignored:
-                                    continue
-                                if entry.name not in rlist:
-                                    sftp.mkdir(self.path + path + '/' + entry.name, mode=0o777 )
-                                t, s = _send(path +'/'+entry.name + '/')
-                                total += t
-                                skipped += s
-                        return total, skipped
-                    except FileNotFoundError:
-                        sftp.close()
-                        raise FileNotFoundError("No such file : %s" % (self.path + os.sep + path))
-                curpath = ''
-                total = 0
-                skipped = 0
-                for d in path.split('/'):
-                    curpath = curpath + d + '/'
-                    lcurpath = curpath if not local else local + os.sep + curpath
-                    if not os.path.isdir(lcurpath):
-                        remote = self.path + path
-                        try:
-                            s = sftp.stat(remote)
-                            skipped += s.st_size
-                        except IOError as e:
-                            if e.errno is errno.ENOENT:
-                                lpath = path if not local else local + os.sep + path
-                                es = os.stat(lpath)
-                                if not es:
-                                    raise FileNotFoundError("[Errno 2] No such local file %s in %s" % (lpath, os.getcwd()))
-                                try:
-                                    sftp.put(lpath, remote)
-                                except PermissionError as e:
-                                    raise PermissionError("[Errno 13] Permission denied when trying to send .access_test to the remote folder '%s' on %s. Do you have the rights?" % (os.path.dirname(remote), self.addr)) from None
-                                except FileNotFoundError as e:
-                                    raise FileNotFoundError("[Errno 2] No such remote folder on %s: %s, please create it" % (self.addr,os.path.dirname(remote))) from None
-                                sftp.chmod(remote, es.st_mode)
-                                total += es.st_size
-                        finally:
-                            sftp.close()
-                        return total, skipped
-                    try:
-                        f = self.path + '/' + curpath
-                        sftp.stat(f)
-                    except FileNotFoundError:
-                        try:
-                            sftp.mkdir(f,mode=0o777)
-                        except IOError as e:
-                            sftp.close()
-                            print("Could not make remote folder %s" % f)
-                            raise e
-                    except PermissionError as e:
-                        sftp.close()
-                        print("Could not make folder %s" % f)
-                        raise e
-
-                t, s = _send(path)
-                total += t
-                skipped += s
-
-                sftp.close()
-                return total, skipped
+                    if os.path.isdir(lpath):
+                        self._make_remote_folders(sftp, path)
+                        lroot, rroot = lpath, remote_path
+                        files, dirs = _local_manifest(lroot)
+                        remote_files, remote_dirs = self._remote_manifest(ssh, sftp, rroot)
+                    else:
+                        self._make_remote_folders(sftp, os.path.dirname(path))
+                        lroot, files = _local_file(lpath)
+                        rroot = os.path.dirname(remote_path)
+                        dirs = []
+                        remote_files = {}
+                        remote_dirs = set()
+                        for name in files:
+                            try:
+                                rs = sftp.stat(rroot + '/' + name)
+                                remote_files[name] = (rs.st_size, rs.st_mtime)
+                            except FileNotFoundError:
+                                pass
+
+                    for d in dirs:
+                        if d not in remote_dirs:
+                            sftp.mkdir(rroot + '/' + d, mode=0o777)
+
+                    same_content = None
+                    if getattr(npf.options, 'send_checksum', False):
+                        same_content = lambda names: self._same_content(ssh, lroot, rroot, names)
+                    to_send, touch, skipped = _plan_send(files, remote_files, same_content)
+                    for name in touch:
+                        mtime = files[name][1]
+                        sftp.utime(rroot + '/' + name, (mtime, mtime))
+                finally:
+                    sftp.close()
+
+            if to_send:
+                #Biggest files first, spread over the workers
+                to_send.sort(key=lambda name: -files[name][0])
+                n = min(SEND_WORKERS, len(to_send))
+                with multiprocessing.pool.ThreadPool(n) as pool:
+                    pool.map(lambda names: self._upload(lroot, rroot, names, files), [to_send[i::n] for i in range(n)])
+
+            return sum(files[name][0] for name in to_send), skipped
 
         except paramiko.ssh_exception.SSHException as e:
             print("Error while connecting to %s" % self.addr)
-            if sftp:
-                sftp.close()
             raise e
 
+    def _make_remote_folders(self, sftp, path):
+        curpath = ''
+        for d in path.split('/'):
+            if not d:
+                continue
+            curpath = curpath + d + '/'
+            f = self.path + '/' + curpath
+            try:
+                sftp.stat(f)
+            except FileNotFoundError:
+                try:
+                    sftp.mkdir(f, mode=0o777)
+                except IOError as e:
+                    print("Could not make remote folder %s" % f)
+                    raise e
+            except PermissionError as e:
+                print("Could not make folder %s" % f)
+                raise e
+
+    def _remote_manifest(self, ssh, sftp, root):
+        """
+        List the files under root on the node with their size and modification time, and the folders.
+        This is done with a single find command, or by listing each folder if find does not support -printf.
+        """
+        files = {}
+        dirs = set()
+        q = shlex.quote(root)
+        stdin, stdout, stderr = ssh.exec_command(
+            "test -d %s || exit 0; find %s -mindepth 1 \\( -type f -printf 'f\\t%%P\\t%%s\\t%%T@\\n' \\) -o \\( -type d -printf 'd\\t%%P\\n' \\)" % (q, q))
+        out = stdout.read().decode("utf-8", errors="replace")
+        if stdout.channel.recv_exit_status() == 0:
+            return _parse_manifest(out)
+
+        def walk(rel):
+            try:
+                entries = sftp.listdir_attr(root + '/' + rel if rel else root)
+            except FileNotFoundError:
+                return
+            for attr in entries:
+                name = rel + '/' + attr.filename if rel else attr.filename
+                if stat.S_ISDIR(attr.st_mode):
+                    dirs.add(name)
+                    walk(name)
+                else:
+                    files[name] = (attr.st_size, attr.st_mtime)
+        walk('')
+        return files, dirs
+
+    def _same_content(self, ssh, lroot, rroot, names):
+        """
+        Return the files of names having the same SHA-256 locally and on the node
+        """
+        stdin, stdout, stderr = ssh.exec_command("cd %s && xargs -0 sha256sum --" % shlex.quote(rroot))
+        stdin.write('\0'.join(names))
+        stdin.channel.shutdown_write()
+        remote = {}
+        for line in stdout.read().decode("utf-8", errors="replace").splitlines():
+            digest, _, name = line.partition('  ')
+            remote[name] = digest
+        stdout.channel.recv_exit_status()
+
+        same = []
+        for name in names:
+            h = hashlib.sha256()
+            with open(os.path.join(lroot, name), 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    h.update(chunk)
+            if remote.get(name, None) == h.hexdigest():
+                same.append(name)
+        return same
+
+    def _upload(self, lroot, rroot, names, files):
+        """
+        Send the files in names over one SFTP session. put() pipelines the writes of each file.
+        """
+        with self.connection() as ssh:
+            sftp = paramiko.SFTPClient.from_transport(ssh.get_transport())
+            try:
+                for name in names:
+                    size, mtime, mode = files[name]
+                    remote = rroot + '/' + name
+                    try:
+                        sftp.put(os.path.join(lroot, name), remote, confirm=False)
+                    except PermissionError:
+                        raise PermissionError("[Errno 13] Permission denied when trying to send %s to the remote folder '%s' on %s. Do you have the rights?" % (name, os.path.dirname(remote), self.addr)) from None
+                    except FileNotFoundError:
+                        raise FileNotFoundError("[Errno 2] Could not send %s to %s on %s" % (os.path.join(lroot, name), remote, self.addr)) from None
+                    sftp.chmod(remote, stat.S_IMODE(mode))
+                    sftp.utime(remote, (mtime, mtime))
+            finally:
+                sftp.close()
 
     def deleteFolder(self, path):
         try:
-            with paramiko.SSHClient() as ssh:
-                ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                ssh.load_system_host_keys()
-                try:
-                    ssh = self.get_connection()
-                except Exception as e:
-                    print("Cannot connect to %s with username %s" % (self.addr,self.user))
-                    raise e
+            with self.connection() as ssh:
 
                 transport = ssh.get_transport()
 
@@ -1,3 +1,4 @@
+import hashlib
 import io
 import math
 import re
@@ -5,6 +6,7 @@ import natsort
 import copy
 import traceback
 import sys
+import pickle
 
 from npf.types.notebook.notebook import prepare_notebook_export
 
@@ -25,6 +27,7 @@ from math import log,pow
 
 from npf.types import dataset
 from npf.types.series import Series
+from npf.types.dataframe import results_dataframe
 from npf.types.dataset import Run, XYEB, AllXYEB, group_val, var_divider
 from npf.variable import is_log, is_numeric, get_numeric, numericable, get_bool, is_bool
 from npf.section import SectionVariable
@@ -49,6 +52,7 @@ import matplotlib.pyplot as plt
 from matplotlib.ticker import Formatter, NullLocator
 from matplotlib.ticker import FuncFormatter, FormatStrFormatter, EngFormatter
 import matplotlib.transforms as mtransforms
+import multiprocessing
 
 
 import itertools
@@ -56,7 +60,6 @@ import math
 import os
 import webcolors
 
-import pandas as pd
 
 graphcolor = [(31, 119, 180), (174, 199, 232), (255, 127, 14), (255, 187, 120),
               (44, 160, 44), (152, 223, 138), (214, 39, 40), (255, 152, 150),
@@ -127,13 +130,102 @@ def smooth(y, box_pts):
     return y_smooth
 
 def smooth_range(x, y, r, newx):
-    new_y = tuple([] for _ in range(len(y)))
-    for x_v in newx:
-        mask = np.logical_and(x > (x_v - r), x <( x_v + r))
-        for i in range(len(y)):
-            l = np.mean(y[i][mask])
-            new_y[i].append(l)
-    return tuple([np.asarray(y) for y in new_y])
+    """
+    Mean of each series of the tuple y over the points whose x is in ]v - r, v + r[, for each v of newx.
+    The windows are found in the sorted x and their sums taken from cumulative sums, so all series are
+    smoothed at once. A window is NaN if it is empty or holds a NaN, and infinite if it holds infinite
+    values of a single sign.
+    """
+    xs = np.asarray(x, dtype=float)
+    ys = np.array([np.asarray(v, dtype=float) for v in y]).reshape(len(y), len(xs))
+    if np.any(xs[1:] < xs[:-1]):
+        order = np.argsort(xs, kind='stable')
+        xs = xs[order]
+        ys = ys[:, order]
+
+    def cumulative(a):
+        return np.concatenate((np.zeros((len(y), 1), dtype=a.dtype), np.cumsum(a, axis=1)), axis=1)
+
+    newx = np.asarray(newx, dtype=float)
+    lo = np.searchsorted(xs, newx - r, side='right')
+    hi = np.maximum(np.searchsorted(xs, newx + r, side='left'), lo)
+    n = hi - lo
+
+    finite = np.isfinite(ys)
+    all_finite = finite.all()
+    #Values are centered before being summed to limit the loss of precision of the differences of sums
+    if all_finite:
+        ref = ys.mean(axis=1, keepdims=True) if len(xs) else np.zeros((len(y), 1))
+        sums = cumulative(ys - ref)
+    else:
+        ref = np.where(finite, ys, 0).sum(axis=1, keepdims=True) / np.maximum(finite.sum(axis=1, keepdims=True), 1)
+        sums = cumulative(np.where(finite, ys - ref, 0))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = (sums[:, hi] - sums[:, lo]) / n + ref
+    means[:, n == 0] = np.nan
+    if not all_finite:
+        nans = cumulative(np.isnan(ys).astype(int))
+        pinfs = cumulative((ys == np.inf).astype(int))
+        ninfs = cumulative((ys == -np.inf).astype(int))
+        pinf = pinfs[:, hi] > pinfs[:, lo]
+        ninf = ninfs[:, hi] > ninfs[:, lo]
+        means[pinf] = np.inf
+        means[ninf] = -np.inf
+        means[(pinf & ninf) | (nans[:, hi] > nans[:, lo]) | (n == 0)] = np.nan
+    return tuple(means)
+
+def lttb_indices(x, y, n):
+    """
+    Indices of n points of the series x, y (sorted by x) keeping its visual shape, using the Largest Triangle
+    Three Buckets algorithm. Points are split in n - 2 buckets between the first and the last point, and in
+    each bucket the point forming the largest triangle with the point kept in the previous bucket and the
+    average of the next one is kept.
+    """
+    l = len(x)
+    if n >= l or n < 3:
+        return np.arange(l)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.arange(n - 1) * (l - 2) // (n - 2) + 1
+    edges = np.append(edges, l)
+    idx = np.empty(n, dtype=int)
+    idx[0] = 0
+    idx[-1] = l - 1
+    a = 0
+    for i in range(n - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < n - 1 else l
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + np.argmax(area)
+        idx[i + 1] = a
+    return idx
+
+def minmax_indices(y, n):
+    """
+    Indices of at most n points of the series y, keeping the minimum and the maximum of n / 2 buckets
+    of consecutive points, and the first and last points
+    """
+    l = len(y)
+    if n >= l or n < 2:
+        return np.arange(l)
+    buckets = max(n // 2 - 1, 1)
+    bucket = np.arange(l) * buckets // l
+    order = np.lexsort((y, bucket))
+    starts = np.searchsorted(bucket, np.arange(buckets))
+    ends = np.append(starts[1:], l)
+    return np.unique(np.concatenate(([0, l - 1], order[starts], order[ends - 1])))
+
+def downsample(x, y, n, method):
+    """
+    Indices of the points of x, y to draw so a line plot shows at most about n points
+    """
+    if method == "minmax":
+        return minmax_indices(y, n)
+    if method != "lttb":
+        print("WARNING: Unknown graph_downsample method %s, using lttb" % method)
+    return lttb_indices(x, y, n)
 
 def roundf(x, prec):
     exp = pow(10, prec)
@@ -177,10 +269,97 @@ def broken_axes_ratio(values):
     return 1
 
 
+#Config keys changing how the series are drawn, the data itself is hashed separately
+GRAPH_CONFIG_PREFIXES = ('graph_', 'var_', 'legend_', 'subplot_', 'grid_')
+
+
+def update_digest(h, obj):
+    """
+    Feed obj to the hash h, going through containers and hashing arrays by their bytes, so large arrays are
+    not summarized like in their repr
+    """
+    if isinstance(obj, np.ndarray):
+        if obj.dtype == object:
+            update_digest(h, obj.tolist())
+        else:
+            h.update(("array%s%s:" % (obj.dtype.str, obj.shape)).encode())
+            h.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, (list, tuple)):
+        h.update(b"(%d:" % len(obj))
+        for o in obj:
+            update_digest(h, o)
+        h.update(b")")
+    elif isinstance(obj, dict):
+        h.update(b"{%d:" % len(obj))
+        for k, v in sorted(obj.items(), key=lambda kv: str(kv[0])):
+            update_digest(h, k)
+            update_digest(h, v)
+        h.update(b"}")
+    elif isinstance(obj, (set, frozenset)):
+        update_digest(h, sorted(obj, key=repr))
+    elif isinstance(obj, Run):
+        update_digest(h, obj.read_variables())
+    elif isinstance(obj, Build):
+        update_digest(h, (obj.pretty_name(), getattr(obj, '_color', None), getattr(obj, '_color_index', None), obj._line, obj._marker))
+    else:
+        h.update(repr(obj).encode())
+        h.update(b";")
+
+
+#Grapher, arguments and figures to draw, inherited by the processes drawing the figures with --graph-jobs
+def _init_graph_worker(options):
+    npf.options = options
+
+
+def _plot_figure_job(payload, i):
+    grapher, args, jobs = pickle.loads(payload)
+    try:
+        return grapher.plot_figure(*args, *jobs[i])
+    finally:
+        sys.stdout.flush()
+
+
 class Grapher:
     def __init__(self):
         self.scripts = set()
         self._config_cache = {}
+        self._pool = None
+        self._pending = []
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_pool'] = None
+        state['_pending'] = []
+        return state
+
+    def graph_pool(self, n_jobs):
+        """
+        Pool of processes drawing the figures. They are started from a fresh interpreter rather than forked, as
+        this process may have threads (SSH transports, executors) that a fork would leave in an unknown state
+        """
+        if self._pool is None:
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            self._pool = multiprocessing.get_context(method).Pool(n_jobs, initializer=_init_graph_worker, initargs=(npf.options,))
+        return self._pool
+
+    def wait(self):
+        """
+        Wait for the figures still being drawn by the pool, and stop it.
+        Returns a dictionary of the figure names to their PNG content or None, as plot_graphs
+        """
+        ret = {}
+        try:
+            for pending in self._pending:
+                r = pending.get()
+                if r is not None:
+                    ret.update(r)
+        finally:
+            self._pending = []
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+        return ret
 
     def config_bool(self, var, default=None):
         val = self.config(var, default)
@@ -602,31 +781,7 @@ class Grapher:
 
         # Add series to a pandas dataframe
         if options.pandas_filename is not None or options.web is not None or options.notebook is not None:
-            all_results_df=pd.DataFrame() # Empty dataframe
-            for test, build, all_results in series:
-                for i, (x) in enumerate(all_results):
-                    if len(x) == 0:
-                        continue
-                    try:
-
-                        labels = [k[1] if type(k) is tuple else k for k,v in x.variables.items()]
-                        x_vars = [[(v[1] if type(v) is tuple else v) for k,v in x.variables.items()]]
-                        x_vars=pd.DataFrame(x_vars,index=[0],columns=labels)
-                        x_vars=pd.concat([pd.DataFrame({'build' :build.pretty_name()},index=[0]), pd.DataFrame({'test_index' :i},index=[0]), x_vars],axis=1)
-
-                        vals = all_results[x]
-                        if not vals:
-                            continue
-                        x_data=pd.DataFrame.from_dict( {"y_"+k: v for k, v in vals.items()},orient='index').transpose() #Use orient='index' to handle lists with different lengths
-                        if len(x_data) == 0:
-                            continue
-                        x_data['run_index']=x_data.index
-                        x_vars = pd.concat([x_vars]*len(x_data), ignore_index=True)
-                        x_df = pd.concat([x_vars, x_data],axis=1)
-                        all_results_df = pd.concat([all_results_df,x_df],ignore_index = True, axis=0)
-                    except Exception as e:
-                        print("ERROR: When trying to export serie %s:" % build.pretty_name())
-
+            all_results_df = results_dataframe(series)
 
             # Save the pandas dataframe into a csv
             if options.pandas_filename is not None:
@@ -1027,6 +1182,43 @@ class Grapher:
             self.plot_graphs(graphs, filename, fileprefix)
 
 
+    def graph_cache_key(self, graphs, fileprefix, figure, text, type_filename) -> str:
+        """
+        Hash of everything the figure saved to type_filename is drawn from : the XYEB data of the result types
+        in figure, the graph config keys and the graph options
+        """
+        from npf.version import __version__
+        h = hashlib.sha256()
+        update_digest(h, (__version__, matplotlib.__version__, type_filename, figure, text))
+        update_digest(h, dict((k, v) for k, v in vars(self.options).items()
+                              if (k.startswith("graph") and k not in ("graph_jobs", "graph_cache")) or k in ("do_transform", "show_serie")))
+        configs = []
+        for script in self.scripts:
+            configs.append([(k, var.makeValues()) for k, var in sorted(script.config.vlist.items()) if k.startswith(GRAPH_CONFIG_PREFIXES)])
+        update_digest(h, sorted(configs, key=repr))
+        for graph in graphs:
+            data_types = graph.dataset(kind=fileprefix)
+            update_digest(h, (graph.title, graph.subtitle, graph.key, graph.vars_values, graph.vars_all))
+            update_digest(h, [(result_type, data_types.get(result_type, None)) for result_type in figure])
+        return h.hexdigest()
+
+    @staticmethod
+    def graph_cache_file(type_filename) -> str:
+        dirname, basename = os.path.split(type_filename)
+        return os.path.join(dirname, "." + basename + ".hash")
+
+    def cached_graph(self, type_filename, key) -> bool:
+        """
+        True if type_filename exists and was drawn from data and config with the hash key
+        """
+        if not os.path.exists(type_filename):
+            return False
+        try:
+            with open(self.graph_cache_file(type_filename), 'r') as f:
+                return f.read().strip() == key
+        except OSError:
+            return False
+
     def plot_graphs(self, graphs, filename, fileprefix):
         """
         This function will sort out the layout of the grid, according to the number of sublot, dual axis, etc...
@@ -1081,78 +1273,135 @@ class Grapher:
             if result_type not in matched_set:
                 plots[result_type] = ([result_type],1,[])
 
-        max_cols = self.config("graph_max_cols", 2)
         graph_only = self.config("graph_only", [])
+        jobs = []
+        first_figure = True
         for result_type, (figure,n_s_cols,subplot_legend_titles) in plots.items():
             if len(figure) == 1 and graph_only and not result_type in graph_only:
                 print("Not graphing %s" % result_type)
                 continue
-            v_cols = len(graphs)
-            v_lines = 1
-            while v_cols > max_cols and v_cols > v_lines:
-                v_cols = math.ceil(v_cols / 2)
-                v_lines *= 2
-            n_cols = v_cols * n_s_cols
 
             if len(self.configlist("graph_display_statics")) > 0:
                 for stat in self.configlist("graph_display_statics"):
                     if text == '' or text[-1] != "\n":
                         text += "\n"
-                    text += str(self.var_name(stat)) + " : " + ', '.join([str(val) for val in graph.vars_values[stat]])
-            n_s_lines = math.ceil((len(figure) + (1 if text else 0)) / float(n_cols))
-            n_lines = v_lines * n_s_lines
-            fig_name = "subplot" + str(result_type)
+                    text += str(self.var_name(stat)) + " : " + ', '.join([str(val) for val in (graph if first_figure else graphs[-1]).vars_values[stat]])
+            first_figure = False
+            type_filename = None
+            cache_key = None
+            if filename:
+                figure_name = figure[0] if len(figure) == 1 else "subplot" + str(result_type)
+                type_filename = npf.build_filename(one_test, one_build, filename if not filename is True else None, graphs[-1].statics(), 'pdf', type_str=(fileprefix +'-' if fileprefix else "") + figure_name, show_serie=False)
+                #Keys are computed before drawing anything, as drawing sets the colors of the builds
+                if getattr(self.options, "graph_cache", True):
+                    cache_key = self.graph_cache_key(graphs, fileprefix, figure, text, type_filename)
+                    if self.cached_graph(type_filename, cache_key):
+                        print("Graph of test unchanged, keeping %s" % type_filename)
+                        ret[figure_name] = None
+                        continue
+            jobs.append((result_type, figure, n_s_cols, subplot_legend_titles, text, type_filename, cache_key))
+
+        n_jobs = getattr(self.options, "graph_jobs", 1)
+        if n_jobs == 0:
+            n_jobs = os.cpu_count()
+        args = (graphs, filename, fileprefix, one_test, one_build)
+        payload = None
+        if n_jobs > 1 and jobs:
+            try:
+                payload = pickle.dumps((self, args, jobs))
+            except Exception as e:
+                print("WARNING: Could not send the figures to other processes, drawing them one after another (%s)" % e)
+        if payload is not None:
+            #Figures are independent, each is drawn by a process of the pool with its own pyplot state
+            pool = self.graph_pool(n_jobs)
+            pending = [pool.apply_async(_plot_figure_job, (payload, i)) for i in range(len(jobs))]
+            if filename:
+                #Figures written to files are collected by wait(), so the next graphs (e.g. time kinds) are drawn meanwhile
+                self._pending.extend(pending)
+            else:
+                for p in pending:
+                    r = p.get()
+                    if r is not None:
+                        ret.update(r)
+        else:
+            for job in jobs:
+                r = self.plot_figure(*args, *job)
+                if r is not None:
+                    ret.update(r)
+        return ret
 
-            i_subplot = 0
-            lgd = None
-            extra_artists = []
-            for graph in graphs:
-                data_types = graph.dataset(kind=fileprefix)
+    def plot_figure(self, graphs, filename, fileprefix, one_test, one_build, result_type, figure, n_s_cols, subplot_legend_titles, text, type_filename=None, cache_key=None):
+        """
+        Draw the figure with the subplots of the result types in figure, and save it to type_filename,
+        remembering cache_key aside if given.
+        Returns a dictionary of the figure name to its PNG content if filename is not set, or None if
+        there was nothing to draw, in which case the other figures are still drawn.
+        """
+        ret = {}
+        max_cols = self.config("graph_max_cols", 2)
+        v_cols = len(graphs)
+        v_lines = 1
+        while v_cols > max_cols and v_cols > v_lines:
+            v_cols = math.ceil(v_cols / 2)
+            v_lines *= 2
+        n_cols = v_cols * n_s_cols
 
-                result = self.generate_plot_for_graph(
-                    result_type, i_subplot, figure, n_cols, n_lines, graph.vars_values,
-                    data_types, graph.dyns(), graph.vars_all, graph.key,
-                    graph.subtitle if graph.subtitle else graph.title,
-                    ret, subplot_legend_titles)
+        n_s_lines = math.ceil((len(figure) + (1 if text else 0)) / float(n_cols))
+        n_lines = v_lines * n_s_lines
+        fig_name = "subplot" + str(result_type)
 
-                if result is None:
-                    continue
-                result_type, lgd, a = result
-                if lgd is not None:
-                    extra_artists += [lgd]
-                extra_artists += a
-
-                i_subplot += len(figure)
-
-            if text:
-                plt.subplot(n_lines, n_cols, len(figure) + 1)
-                plt.axis('off')
-                plt.figtext(.05, (0.5 / (len(figure) + 1)), text.replace("\\n", "\n"), verticalalignment='center',
-                            horizontalalignment='left')
-
-            if len(figure) > 1:
-                if i_subplot < len(figure) - 1:
-                    return
-                else:
-                    result_type = fig_name
-            if not filename:
-                buf = io.BytesIO()
-                plt.savefig(buf, format='png', bbox_extra_artists=(extra_artists,) if len(extra_artists) > 0 else [], bbox_inches='tight')
-                buf.seek(0)
-                ret[result_type] = buf.read()
+        i_subplot = 0
+        lgd = None
+        extra_artists = []
+        for graph in graphs:
+            data_types = graph.dataset(kind=fileprefix)
+
+            result = self.generate_plot_for_graph(
+                result_type, i_subplot, figure, n_cols, n_lines, graph.vars_values,
+                data_types, graph.dyns(), graph.vars_all, graph.key,
+                graph.subtitle if graph.subtitle else graph.title,
+                ret, subplot_legend_titles)
+
+            if result is None:
+                continue
+            result_type, lgd, a = result
+            if lgd is not None:
+                extra_artists += [lgd]
+            extra_artists += a
+
+            i_subplot += len(figure)
+
+        if text:
+            plt.subplot(n_lines, n_cols, len(figure) + 1)
+            plt.axis('off')
+            plt.figtext(.05, (0.5 / (len(figure) + 1)), text.replace("\\n", "\n"), verticalalignment='center',
+                        horizontalalignment='left')
+
+        if len(figure) > 1:
+            if i_subplot < len(figure) - 1:
+                return None
             else:
-                type_filename = npf.build_filename(one_test, one_build, filename if not filename is True else None, graph.statics(), 'pdf', type_str=(fileprefix +'-' if fileprefix else "") +result_type, show_serie=False)
-                try:
-                    plt.savefig(type_filename, bbox_extra_artists=extra_artists if len(extra_artists) > 0 else [],
-                            bbox_inches='tight',
-                            dpi=self.options.graph_dpi, transparent=True)
-                    print("Graph of test written to %s" % type_filename)
-                except Exception as e:
-                    print("ERROR : Could not draw the graph!")
-                    print(e)
-                    traceback.print_exc()
-                ret[result_type] = None
-            plt.clf()
+                result_type = fig_name
+        if not filename:
+            buf = io.BytesIO()
+            plt.savefig(buf, format='png', bbox_extra_artists=(extra_artists,) if len(extra_artists) > 0 else [], bbox_inches='tight')
+            buf.seek(0)
+            ret[result_type] = buf.read()
+        else:
+            try:
+                plt.savefig(type_filename, bbox_extra_artists=extra_artists if len(extra_artists) > 0 else [],
+                        bbox_inches='tight',
+                        dpi=self.options.graph_dpi, transparent=True)
+                print("Graph of test written to %s" % type_filename)
+                if cache_key:
+                    with open(self.graph_cache_file(type_filename), 'w') as f:
+                        f.write(cache_key)
+            except Exception as e:
+                print("ERROR : Could not draw the graph!")
+                print(e)
+                traceback.print_exc()
+            ret[result_type] = None
+        plt.clf()
         return ret
 
 
@@ -2032,6 +2281,14 @@ class Grapher:
                 y,ymin,ymax,mean,std = smooth_range(ax,(y,ymin,ymax,mean,std),smcon*diff/100,nx)
                 ax = nx
 
+            #Draw only a subset of the points of large series, filters need all points to align with their own series
+            max_points = self.config("graph_max_points", 0)
+            if max_points and len(ax) > max_points and result_type not in filters:
+                keep = downsample(ax, y, max_points, self.config("graph_downsample", "lttb"))
+                if len(order) == len(ax):
+                    order = order[keep]
+                ax,y,ymin,ymax,mean,std = ax[keep],y[keep],ymin[keep],ymax[keep],mean[keep],std[keep]
+
             lab = build.pretty_name()
             while lab.startswith('_'):
                 lab = lab[1:]
@@ -97,6 +97,12 @@ def add_graph_options(parser: ArgumentParser):
 
     g.add_argument('--graph-dpi', dest='graph_dpi', type=int, default=300)
 
+    g.add_argument('--graph-jobs', metavar='N', dest='graph_jobs', type=int, default=1,
+                   help='Draw up to N figures at once, including those of the time series, in separate processes, 0 for one per CPU')
+
+    g.add_argument('--no-graph-cache', dest='graph_cache', action='store_false', default=True,
+                   help='Always redraw the graphs, even if their data and config did not change since they were written')
+
     g.add_argument('--no-graph-time', dest='do_time', action='store_false', default=True)
 
     g.add_argument('--no-graph', dest='no_graph', action='store_true', default=False)
@@ -154,6 +160,14 @@ def add_testing_options(parser: ArgumentParser, regression: bool = False):
                    nargs='?',
                    default=0)
     t.add_argument('--result-path', '--result-folder', metavar='path', type=str, nargs=1, help='Path to NPF\'s own database of results. By default it is a "result" folder.', default=["results"])
+    t.add_argument('--result-format', metavar='format', type=str, choices=['text', 'columnar'], default='text', dest='result_format',
+                   help='Format used to write results in the database. "columnar" stores binary arrays that are loaded without parsing, which is much faster for big results. Both formats are read transparently.')
+    t.add_argument('--shard', metavar='i/N', type=str, default=None, dest='shard',
+                   help='Only run the i-th of N parts of the variable points, and write results in a separate file for that part. Use --merge-shards to gather all parts.')
+    t.add_argument('--merge-shards', dest='merge_shards', action='store_true', default=False,
+                   help='Merge the results of all shards into the results of the test before running it')
+    t.add_argument('--result-cache-size', metavar='MB', type=int, default=None, dest='result_cache_size',
+                   help='Maximal memory used by the results kept in memory once loaded, as estimated from their number of values. Default to 1024MB.')
     t.add_argument('--tags', metavar='tag', type=str, nargs='+', help='list of tags', default=[], action=ExtendAction)
     t.add_argument('--variables', metavar='variable=value', type=str, nargs='+', action=ExtendAction,
                    help='list of variables values to override', default=[])
@@ -213,6 +227,10 @@ def add_building_options(parser):
     b.add_argument('--force-build-deps',
                     help='Force to rebuild some dependencies', dest='force_build_deps',
                    action=ExtendAction, default=[], nargs='+')
+    b.add_argument('--send-checksum',
+                    help='When sending software to nodes without NFS, compare the content of files that have the same size '
+                         'but another modification time instead of sending them again', dest='send_checksum',
+                   action='store_true', default=False)
     return b
 
 nodePattern = regex.compile(
@@ -264,6 +282,15 @@ def initialize(args):
         if options.use_last:
             options.use_last = 100
 
+    if options.shard:
+        try:
+            i, n = [int(x) for x in options.shard.split('/')]
+        except ValueError:
+            raise Exception("Invalid shard %s, it must be given as i/N" % options.shard)
+        if n < 1 or i < 1 or i > n:
+            raise Exception("Invalid shard %s, i must be between 1 and N" % options.shard)
+        options.shard = (i, n)
+
     if not os.path.exists(experiment_path()):
         raise Exception("The experiment root '%s' is not accessible ! Please explicitely define it with --experiment-path, and ensure that directory is writable !" % experiment_path())
 
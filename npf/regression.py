@@ -140,8 +140,10 @@ class Regression:
                     if not test.options.quiet_regression:
                         print("Acceptable difference of %.2f%% for %s" % ((diff * 100), run.format_variables()))
 
+        test.close_pool()
+
         if supp_done and all_results:
-            build.writeversion(test, all_results, allow_overwrite = True)
+            build.writeversion(test, all_results, allow_overwrite = True, shard = getattr(test.options, 'shard', None))
         return tests_passed, tests_total
 
     def regress_all_tests(  self,
@@ -179,6 +181,10 @@ class Regression:
             else:
                 print(f"[{repo.name}] Running test {test.filename}...")
             regression = self
+            if options.merge_shards:
+                n = build.merge_shards(test)
+                if n:
+                    print(f"[{repo.name}] Merged the results of {n} shards")
             if repo.last_build:
                 try:
                     old_all_results = repo.last_build.load_results(test)
@@ -197,8 +203,8 @@ class Regression:
                     early_results = None
                 all_results,time_results, init_done = test.execute_all(
                                                 build,
-                                                prev_results=build.load_results(test),
-                                                prev_time_results=build.load_results(test, kind=True),
+                                                prev_results=build.load_results(test, shard=getattr(options, 'shard', None)),
+                                                prev_time_results=build.load_results(test, kind=True, shard=getattr(options, 'shard', None)),
                                                 options=options,
                                                 do_test=options.do_test,
                                                 on_finish=early_results,
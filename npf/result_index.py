@@ -0,0 +1,61 @@
+import os
+import sqlite3
+
+from npf.types.dataset import Run
+
+
+def run_key(run: Run) -> str:
+    """
+    Canonical text representation of the variables of a run, equal for runs that compare equal
+    """
+    return "\n".join(key + ":" + str(val) for key, val in run.key())
+
+
+class ResultIndex:
+    """
+    Index of the runs found in the results of all versions of a repository, so the version holding a
+    given run can be found without loading the results of every version.
+    The index is a SQLite database in the results folder of the repository. The results of a version
+    are (re)indexed when they changed on disk since they were last indexed.
+    """
+    def __init__(self, folder):
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.db = sqlite3.connect(folder + "index.sqlite", timeout=60)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS runs (test TEXT, run TEXT, version TEXT, PRIMARY KEY (test, run, version))")
+            self.db.execute("CREATE TABLE IF NOT EXISTS versions (test TEXT, version TEXT, stamp TEXT, PRIMARY KEY (test, version))")
+
+    def update(self, test, builds):
+        """
+        Index the results of test for all builds whose results are not already indexed
+        """
+        indexed = dict(self.db.execute("SELECT version, stamp FROM versions WHERE test = ?", (test.filename,)).fetchall())
+        for build in builds:
+            stamp = repr(build.results_stamp(test))
+            if indexed.get(build.version, None) == stamp:
+                continue
+            results = build.load_results(test)
+            with self.db:
+                self.db.execute("DELETE FROM runs WHERE test = ? AND version = ?", (test.filename, build.version))
+                if results:
+                    self.db.executemany("INSERT OR IGNORE INTO runs VALUES (?, ?, ?)",
+                                        [(test.filename, run_key(run), build.version) for run, r in results.items() if r])
+                self.db.execute("INSERT OR REPLACE INTO versions VALUES (?, ?, ?)", (test.filename, build.version, stamp))
+
+    def lookup(self, test, run, versions):
+        """
+        Return the first version of versions having results for run, or None
+        """
+        if not versions:
+            return None
+        found = set(v for v, in self.db.execute(
+            "SELECT version FROM runs WHERE test = ? AND run = ? AND version IN (%s)" % ",".join("?" * len(versions)),
+            [test.filename, run_key(run)] + list(versions)))
+        for version in versions:
+            if version in found:
+                return version
+        return None
+
+    def close(self):
+        self.db.close()
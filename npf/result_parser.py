@@ -0,0 +1,145 @@
+"""
+Extraction of the results from the output of the scripts while they run.
+
+Each script execution gets an OutputSink that the executor calls for every line of output. The matches of
+the result regexes are collected line by line, and only a bounded tail of the raw output is kept for error
+messages. Regexes that may match across lines are run on the whole output once the scripts are finished.
+Lines not containing RESULT are skipped without running the regexes that cannot match them.
+"""
+import re
+from collections import deque
+from typing import List, Tuple
+
+_RESULT = re.compile('RESULT', re.IGNORECASE)
+
+#Regex constructs that may match a new line, or that depend on the position in the whole output
+_MULTILINE_CONSTRUCTS = ['\\s', '\\n', '\\r', '\\W', '\\D', '[^', '(?s', '(?m', '^', '$', '\\A', '\\Z']
+
+
+def is_line_regex(regex: str) -> bool:
+    """
+    True if all matches of regex over a whole output are found by matching it over each line separately
+    """
+    return not any(c in regex for c in _MULTILINE_CONSTRUCTS)
+
+
+def requires_literal(regex: str, literal: str) -> bool:
+    """
+    True if every match of regex contains literal, that is if literal appears outside of any group or set,
+    is not followed by a quantifier and regex has no top-level alternative
+    """
+    depth = 0
+    i = 0
+    found = False
+    while i < len(regex):
+        c = regex[i]
+        if c == '\\':
+            i += 2
+            continue
+        if c == '[':
+            #Skip the set, a ] right after [ or [^ is part of it
+            j = i + 1
+            if regex[j:j + 1] == '^':
+                j += 1
+            if regex[j:j + 1] == ']':
+                j += 1
+            while j < len(regex) and regex[j] != ']':
+                j += 2 if regex[j] == '\\' else 1
+            if j >= len(regex):
+                return False
+            i = j
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == '|' and depth == 0:
+            return False
+        elif depth == 0 and regex.startswith(literal, i) and regex[i + len(literal):i + len(literal) + 1] not in ('?', '*', '{'):
+            found = True
+        i += 1
+    return found
+
+
+class OutputSink:
+    """
+    Receives the output of one script execution line by line, keeping the matches of the line regexes of
+    the parser and the last lines of stdout and stderr. Stdout is entirely kept if some regex is not
+    line-oriented.
+    """
+    def __init__(self, parser: 'ResultParser'):
+        self.parser = parser
+        self.matches = [[] for _ in parser.regexes]
+        tail = parser.tail if parser.tail > 0 else None
+        self.outputs = [deque(maxlen=None if not parser.streaming else tail), deque(maxlen=tail)]
+        self.lines = [0, 0]
+
+    def __call__(self, ichannel, line):
+        self.outputs[ichannel].append(line)
+        self.lines[ichannel] += 1
+        if ichannel == 0 and self.parser.streaming:
+            has_result = None
+            for i, regex in enumerate(self.parser.regexes):
+                if self.parser.prefiltered[i]:
+                    if has_result is None:
+                        has_result = _RESULT.search(line) is not None
+                    if not has_result:
+                        continue
+                self.matches[i].extend(regex.finditer(line))
+
+    def output(self, ichannel) -> str:
+        lines = self.outputs[ichannel]
+        if self.lines[ichannel] > len(lines):
+            return "[%d lines not kept]\n" % (self.lines[ichannel] - len(lines)) + ''.join(lines)
+        return ''.join(lines)
+
+
+class ResultParser:
+    """
+    Result regexes of a test, compiled once, and the flags of each result type.
+
+    :param tail: Number of lines of stdout and stderr kept for each script, 0 to keep everything
+    :param config: Config section giving accept_zero, result_add, result_append and result_overwrite
+    """
+    def __init__(self, regex_list: List[str], tail: int = 0, config=None):
+        self.regexes = [re.compile(regex, re.IGNORECASE) for regex in regex_list]
+        self.streaming = all(is_line_regex(regex) for regex in regex_list)
+        self.prefiltered = [requires_literal(regex.upper(), 'RESULT') for regex in regex_list]
+        self.tail = tail
+        self.config = config
+        self._flags = {}
+
+    def flags(self, result_type) -> Tuple[bool, bool, bool, bool]:
+        """
+        Return accept_zero, result_add, result_append and result_overwrite for result_type,
+        looked up in the config only the first time
+        """
+        flags = self._flags.get(result_type, None)
+        if flags is None:
+            config = self.config
+            flags = (config.match("accept_zero", result_type),
+                     config.get_bool_or_in("result_add", result_type),
+                     config.get_bool_or_in("result_append", result_type),
+                     config.get_bool_or_in("result_overwrite", result_type))
+            self._flags[result_type] = flags
+        return flags
+
+    def sink(self) -> OutputSink:
+        return OutputSink(self)
+
+    def matches(self, parts):
+        """
+        Yield the matches of all regexes over parts, a list of OutputSink or strings in the order of the output,
+        in the same order as running each regex one after the other over the concatenated output
+        """
+        if not self.streaming:
+            output = ''.join(part.output(0) if isinstance(part, OutputSink) else part for part in parts).strip()
+            for regex in self.regexes:
+                yield from regex.finditer(output)
+            return
+
+        for i, regex in enumerate(self.regexes):
+            for part in parts:
+                if isinstance(part, OutputSink):
+                    yield from part.matches[i]
+                else:
+                    yield from regex.finditer(part)
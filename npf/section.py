@@ -1,4 +1,5 @@
 import ast
+import itertools
 
 from typing import List, Set
 from collections.abc import Mapping
@@ -327,28 +328,56 @@ class SectionRequire(Section):
 
 
 class BruteVariableExpander:
-    """Expand all variables building the full
-    matrix first."""
-
-    def __init__(self, vlist, overriden):
-        self.expanded = [OrderedDict()]
+    """Expand all variables, enumerating the full
+    matrix lazily. Points are numbered so the first
+    variable changes the fastest, and can be accessed
+    by index without enumerating the previous ones.
+    With a shard (i, N), only the points whose index
+    modulo N is i-1 are expanded."""
+
+    def __init__(self, vlist, overriden, shard=None):
+        self.values = []
         for k, v in vlist.items():
             if k in overriden:
                 continue
-            newList = []
-            l = v.makeValues()
+            self.values.append((k, v.makeValues()))
+        self.total = 1
+        for k, l in self.values:
+            self.total *= len(l)
+        if shard:
+            self.first, self.step = shard[0] - 1, shard[1]
+        else:
+            self.first, self.step = 0, 1
+        self.n = len(range(self.first, self.total, self.step))
+        self.it = self.__iter__()
 
-            for nvalue in l:
-                for ovalue in self.expanded:
-                    z = ovalue.copy()
-                    z.update(nvalue if type(nvalue) is OrderedDict else {k: nvalue})
-                    newList.append(z)
+    @staticmethod
+    def _point(values):
+        z = OrderedDict()
+        for k, nvalue in values:
+            z.update(nvalue if type(nvalue) is OrderedDict else {k: nvalue})
+        return z
 
-            self.expanded = newList
-        self.it = self.expanded.__iter__()
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.n
+        if i < 0 or i >= self.n:
+            raise IndexError("Point %d does not exist, there are %d points" % (i, self.n))
+        i = self.first + i * self.step
+        values = []
+        for k, l in self.values:
+            i, r = divmod(i, len(l))
+            values.append((k, l[r]))
+        return self._point(values)
 
     def __iter__(self):
-        return self.expanded.__iter__()
+        names = [k for k, l in self.values]
+        combinations = itertools.product(*reversed([l for k, l in self.values]))
+        for combination in itertools.islice(combinations, self.first, None, self.step):
+            yield self._point(zip(names, reversed(combination)))
 
     def __next__(self):
         return self.it.__next__()
@@ -357,10 +386,18 @@ class BruteVariableExpander:
 class RandomVariableExpander(BruteVariableExpander):
     """Same as BruteVariableExpander but shuffle the series to test"""
 
-    def __init__(self, vlist):
-        super().__init__(vlist)
-        shuffle(self.expanded)
-        self.it == self.expanded.__iter__()
+    def __init__(self, vlist, overriden, shard=None):
+        super().__init__(vlist, overriden, shard)
+        self.order = list(range(self.n))
+        shuffle(self.order)
+        self.it = self.__iter__()
+
+    def __getitem__(self, i):
+        return super().__getitem__(self.order[i])
+
+    def __iter__(self):
+        for i in self.order:
+            yield super().__getitem__(i)
 
 
 class SectionVariable(Section):
@@ -381,11 +418,14 @@ class SectionVariable(Section):
             values.append(SectionVariable.replace_variables(v, value))
         return values
 
-    def expand(self, method=None, overriden=set()):
+    def expand(self, method=None, overriden=set(), shard=None):
+        """
+        :param shard: A tuple (i, N) to expand only the i-th of N disjoint parts of the points
+        """
         if method == "shuffle" or method == "rand" or method == "random":
-            return RandomVariableExpander(self.vlist)
+            return RandomVariableExpander(self.vlist, overriden, shard)
         else:
-            return BruteVariableExpander(self.vlist, overriden)
+            return BruteVariableExpander(self.vlist, overriden, shard)
 
     def __iter__(self):
         return self.expand()
@@ -648,6 +688,9 @@ class SectionConfig(SectionVariable):
         self.__add("n_runs", 3)
         self.__add("n_retry", 0)
         self.__add_dict("var_n_runs", {})
+        self.__add("n_runs_ci", 0) #Relative confidence interval to reach before stopping repetitions, 0 to always do n_runs
+        self.__add("n_runs_confidence", 0.95)
+        self.__add("n_runs_max", 20)
         self.__add_dict("var_markers", {}) #Do not set CDF here, small CDF may want them, and then scatterplot would not work
         self.__add("result_add", False)
         self.__add("result_append", False)
@@ -659,6 +702,7 @@ class SectionConfig(SectionVariable):
         self.__add("critical", False)
         self.__add_dict("env", {})  # Unimplemented yet
         self.__add("timeout", 30)
+        self.__add("output_tail", 1000) #Lines of stdout and stderr kept per script for error messages, 0 to keep everything
         self.__add("hardkill", 5000)
 
         # Role related
@@ -733,6 +777,8 @@ class SectionConfig(SectionVariable):
         self.__add_dict("graph_label_dir", {})
         self.__add("graph_force_diagonal_labels", False)
         self.__add("graph_smooth", 1)
+        self.__add("graph_max_points", 2000) #Line plots with more points per series are downsampled, 0 to draw all points
+        self.__add("graph_downsample", "lttb") #Downsampling method, lttb (largest triangle three buckets) or minmax
 
         # Time series
         self.__add("time_precision", 1)
@@ -1,4 +1,5 @@
 import multiprocessing
+import multiprocessing.pool
 import os
 import sys
 import threading
@@ -10,15 +11,19 @@ import datetime
 import itertools
 import string
 from pathlib import Path
-from queue import Empty
+from queue import Empty, Queue
+from types import SimpleNamespace
 from typing import Tuple, Dict
 import numpy as np
+from scipy import stats
 from npf.build import Build
+from npf.result_index import ResultIndex
 from npf.node import NIC
 from npf.section import *
 from npf.npf import get_valid_filename
 from npf.types.dataset import Run, Dataset
 from npf.eventbus import EventBus
+from npf.result_parser import ResultParser
 from .variable import get_bool
 from decimal import *
 from functools import reduce
@@ -56,6 +61,7 @@ class RemoteParameters:
         self.testdir = None
         self.waitfor = None
         self.event = None
+        self.sink = None
         self.title = None
         self.env = None
         self.virt = ""
@@ -95,7 +101,11 @@ def _parallel_exec(param: RemoteParameters):
                                  event=param.event,
                                  title=param.name,
                                  env=param.env,
-                                 virt=param.virt)
+                                 virt=param.virt,
+                                 sink=param.sink)
+    if param.sink:
+        o = param.sink.output(0)
+        e = param.sink.output(1)
 
     sys.stdout.flush()
     sys.stderr.flush()
@@ -170,6 +180,9 @@ class Test:
         self.tags = tags or []
         self.role = role
         self.pyexits = []
+        self._pool = None
+        self._pool_size = 0
+        self._result_parser = None
 
         i = -1
         try:
@@ -343,20 +356,28 @@ class Test:
                     deprepo = Repository.get_instance(dep, self.options)
 
                     toSend.add((deprepo.reponame,role,node,deprepo.get_build_path(), deprepo.get_remote_build_path(node)))
-        for repo,role,node,bp,rbp in toSend.difference(done):
-            print("Sending software %s to %s... " % (repo, role), end ='')
+        def send(item):
+            repo,role,node,bp,rbp = item
             try:
-
                 #We have to find the local path from which the remote start, so we can advance in the folder at the same point
                 local = os.path.normpath(bp)
                 r = os.path.normpath(rbp)
                 while os.path.basename(local) == os.path.basename(r):
                     local = os.path.dirname(os.path.normpath(local))
                     r = os.path.dirname(os.path.normpath(r))
-                t,s = node.executor.sendFolder(rbp,local)
+                return node.executor.sendFolder(rbp,local)
             except Exception as e:
                 print ("While sending %s (to folder %s) on node %s= " %  (bp, rbp, node.addr))
                 raise e
+
+        #All nodes receive their software at the same time
+        pending = list(toSend.difference(done))
+        sent = []
+        if pending:
+            with multiprocessing.pool.ThreadPool(len(pending)) as pool:
+                sent = pool.map(send, pending)
+        for (repo,role,node,bp,rbp), (t,s) in zip(pending, sent):
+            print("Sending software %s to %s (%s)... " % (repo, role, node.get_name()), end ='')
             if t > 0 and s > 0:
                 print("%d bytes sent / %d bytes already up to date." % (t,s))
             elif t > 0 and s == 0:
@@ -386,7 +407,7 @@ class Test:
                     print("Sending files %s to %s... " % (fpath, role), end = '')
                     t = node.executor.sendFolder(fpath)
                     if (t[0] > 0):
-                        print("%d bytes sent." % t)
+                        print("%d bytes sent." % t[0])
                     else:
                         print("Already up to date !")
 
@@ -441,15 +462,25 @@ class Test:
             else:
                 unique_list[filename + (role or '')] = (filename, p, role)
 
+        #All the files of a node are sent at once
+        node_files = OrderedDict()
         for _, (filename, p, role) in unique_list.items():
             if self.options.show_files:
                 print("File %s:" % filename)
                 print(p.strip())
             for node in npf.nodes_for_role(role):
-                if not node.executor.writeFile(filename, path_to_root, p):
-                    print("Re-trying with sudo...")
-                    if not node.executor.writeFile(filename, path_to_root, p, sudo=True):
-                        raise Exception("Could not create file %s on %s" % (filename, node.name))
+                node_files.setdefault(node, []).append((filename, p))
+
+        for node, files in node_files.items():
+            #Files on shared folders are deleted by cleanup() after each run, the others can be kept if unchanged
+            skip = not node.nfs
+            saved = node.executor.bytes_saved
+            if not node.executor.writeFiles(files, path_to_root, skip_unchanged=skip):
+                print("Re-trying with sudo...")
+                if not node.executor.writeFiles(files, path_to_root, sudo=True, skip_unchanged=skip):
+                    raise Exception("Could not create files %s on %s" % (', '.join(f for f, _ in files), node.name))
+            if self.options.debug and node.executor.bytes_saved > saved:
+                print("[DEBUG] %d bytes of unchanged files not sent again to %s (%d in total)" % (node.executor.bytes_saved - saved, node.name, node.executor.bytes_saved))
 
     def test_require(self, v, build):
         for require in self.requirements + list(itertools.chain.from_iterable([imp.test.requirements for imp in self.imports])):
@@ -525,81 +556,93 @@ class Test:
 
     def parse_results(self, regex_list: str, output: str, new_time_results: dict, new_data_results: dict) -> Tuple[
         bool, bool]:
+        return self.add_results(ResultParser(regex_list).matches([output]), new_time_results, new_data_results)
+
+    def result_parser(self) -> ResultParser:
+        """
+        The result regexes of the test, compiled once, and the flags of each result type
+        """
+        if self._result_parser is None:
+            self._result_parser = ResultParser(self.config.get_list("result_regex"), tail=self.config["output_tail"], config=self.config)
+        return self._result_parser
+
+    def add_results(self, matches, new_time_results: dict, new_data_results: dict) -> Tuple[bool, bool]:
+        """
+        Add the results found by the matches of the result regexes
+        """
+        parser = self.result_parser()
         has_err = False
         has_values = False
         try:
-            for result_regex in regex_list:
-                for nr in re.finditer(result_regex, output.strip(), re.IGNORECASE):
-                    result_type = nr.group("type")
-
-                    time_ns = nr.group("kind")
-                    if time_ns is None:
-                        time_ns = "time"
-                    time_value = nr.group("time_value")
-                    if result_type is None:
-                        result_type = ''
-                    n = float(nr.group("value"))
-                    mult = nr.group("multiplier")
-                    unit = ""
-                    if nr.group("unit"):
-                        unit = nr.group("unit")
-                    if unit.lower() == "sec" or unit.lower() == "s":
-                        unit = "s"
-
-                    if unit == "s":
-                        if mult == "m":
-                            n = n / 1000  # Keep all results in seconds
-                        elif mult == "u" or mult == "µ":
-                            n = n / 1000000
-                        elif mult == "n":
-                            n = n / 1000000000
-                    else:
-                        mult = mult.upper()
-
-                    if mult == "K":
-                        n *= 1024
-                    elif mult == "M":
-                        n *= 1024 * 1024
-                    elif mult == "G":
-                        n *= 1024 * 1024 * 1024
-                    if n != 0 or (self.config.match("accept_zero", result_type)) or time_value is not None:
-                        result_add = self.config.get_bool_or_in("result_add", result_type)
-                        result_append = self.config.get_bool_or_in("result_append", result_type)
-                        result_overwrite = self.config.get_bool_or_in("result_overwrite", result_type)
-                        if time_value:
-                            t = float(time_value)
-                            if result_type in new_time_results.setdefault(time_ns,{}).setdefault(t, {}):
-                                #Result is already known
-                                if result_add:
-                                    new_time_results[time_ns][t][result_type] += n
-                                elif result_overwrite:
-                                    new_time_results[time_ns][t][result_type] = n
-                                else:
-                                    if not result_append:
-                                        print(f"WARNING: There are multiple occurences of metric {result_type} for the same time {t}, please add the metric {result_type} in result_add, result_append or result_overwrite. result_appe d is selected by default, add `result_append={{{result_type}}}` to %config to silent this message.")
+            for nr in matches:
+                result_type = nr.group("type")
+
+                time_ns = nr.group("kind")
+                if time_ns is None:
+                    time_ns = "time"
+                time_value = nr.group("time_value")
+                if result_type is None:
+                    result_type = ''
+                n = float(nr.group("value"))
+                mult = nr.group("multiplier")
+                unit = ""
+                if nr.group("unit"):
+                    unit = nr.group("unit")
+                if unit.lower() == "sec" or unit.lower() == "s":
+                    unit = "s"
+
+                if unit == "s":
+                    if mult == "m":
+                        n = n / 1000  # Keep all results in seconds
+                    elif mult == "u" or mult == "µ":
+                        n = n / 1000000
+                    elif mult == "n":
+                        n = n / 1000000000
+                else:
+                    mult = mult.upper()
+
+                if mult == "K":
+                    n *= 1024
+                elif mult == "M":
+                    n *= 1024 * 1024
+                elif mult == "G":
+                    n *= 1024 * 1024 * 1024
+                accept_zero, result_add, result_append, result_overwrite = parser.flags(result_type)
+                if n != 0 or accept_zero or time_value is not None:
+                    if time_value:
+                        t = float(time_value)
+                        if result_type in new_time_results.setdefault(time_ns,{}).setdefault(t, {}):
+                            #Result is already known
+                            if result_add:
+                                new_time_results[time_ns][t][result_type] += n
+                            elif result_overwrite:
+                                new_time_results[time_ns][t][result_type] = n
+                            else:
+                                if not result_append:
+                                    print(f"WARNING: There are multiple occurences of metric {result_type} for the same time {t}, please add the metric {result_type} in result_add, result_append or result_overwrite. result_appe d is selected by default, add `result_append={{{result_type}}}` to %config to silent this message.")
 
-                                    if type(new_time_results[time_ns][t][result_type]) is not list:
-                                        new_time_results[time_ns][t][result_type] = [new_time_results[time_ns][t][result_type]]
+                                if type(new_time_results[time_ns][t][result_type]) is not list:
+                                    new_time_results[time_ns][t][result_type] = [new_time_results[time_ns][t][result_type]]
 
-                                    new_time_results[time_ns][t][result_type].append(n)
-                            else:
-                                new_time_results[time_ns][t][result_type] = n
+                                new_time_results[time_ns][t][result_type].append(n)
                         else:
-                            if result_append:
-                                new_data_results.setdefault(result_type,[]).append(n)
-                            elif result_type in new_data_results:
-                                if result_add:
-                                    new_data_results[result_type] += n
-                                else:
-                                    if not result_overwrite:
-                                        print(f"WARNING: There are multiple occurences of metric {result_type}, please add it in result_add, result_append or result_overwrite. result_overwrite is selected by default, add `result_overwrite={{{result_type}}}` to %config to silent this message.")
-                                    new_data_results[result_type] = n
+                            new_time_results[time_ns][t][result_type] = n
+                    else:
+                        if result_append:
+                            new_data_results.setdefault(result_type,[]).append(n)
+                        elif result_type in new_data_results:
+                            if result_add:
+                                new_data_results[result_type] += n
                             else:
+                                if not result_overwrite:
+                                    print(f"WARNING: There are multiple occurences of metric {result_type}, please add it in result_add, result_append or result_overwrite. result_overwrite is selected by default, add `result_overwrite={{{result_type}}}` to %config to silent this message.")
                                 new_data_results[result_type] = n
-                        has_values = True
-                    else:
-                        print("Result for %s is 0 !" % result_type)
-                        has_err = True
+                        else:
+                            new_data_results[result_type] = n
+                    has_values = True
+                else:
+                    print("Result for %s is 0 !" % result_type)
+                    has_err = True
 
         except Exception as e:
             print("Exception while parsing results :")
@@ -673,22 +716,24 @@ class Test:
         # Launching the tests in itself
         data_results = OrderedDict()  # dict of result_name -> [val, val, val]
         all_time_results = {}  # dict of kind -> time_value -> {result_name -> [val, val, val]}
-        m = multiprocessing.Manager()
         all_output = []
         all_err = []
+        parser = self.result_parser()
         for i in range(n_runs):
             for i_try in range(n_retry + 1):
                 if i_try > 0 and not self.options.quiet:
                     print("Re-try tests %d/%d..." % (i_try, n_retry + 1))
                 output = ''
                 err = ''
+                #Outputs in order, as sinks that parsed the scripts output while they ran, or strings
+                parts = []
 
                 if before_test:
                     before_test(i,i_try)
 
-                queue = m.Queue()
+                queue = Queue()
 
-                event = EventBus(m)
+                event = EventBus()
 
                 remote_params = []
                 for t, v, role in (
@@ -701,7 +746,7 @@ class Test:
                     srole = role or script.get_role()
                     nodes = npf.nodes_for_role(srole)
 
-                    autokill = m.Value('i', 0) if npf.parseBool(script.params.get("autokill", t.config["autokill"])) else None
+                    autokill = SimpleNamespace(value=0) if npf.parseBool(script.params.get("autokill", t.config["autokill"])) else None
                     v["NPF_NODE_MAX"] = len(nodes)
                     for i_node, node in enumerate(nodes):
                       v["NPF_NODE"] = node.get_name()
@@ -788,6 +833,7 @@ class Test:
                         param.bin_paths = deps_bin_path + [build.get_remote_bin_folder(node)]
                         param.testdir = test_folder
                         param.event = event
+                        param.sink = parser.sink()
                         param.script = script
                         param.name = script.get_name(True)
                         param.autokill = autokill
@@ -813,8 +859,7 @@ class Test:
                 try:
                     ##### Actual execution ######
                     if self.options.allow_mp:
-                        p = multiprocessing.pool.ThreadPool(n)
-                        parallel_execs = p.map(_parallel_exec,
+                        parallel_execs = self.executor_pool(n).map(_parallel_exec,
                                                remote_params)
 
                     else:
@@ -825,9 +870,7 @@ class Test:
 
                 except KeyboardInterrupt:
                     print("Program is interrupted")
-                    if self.options.allow_mp:
-                        p.close()
-                        p.terminate()
+                    self.close_pool()
 
                     if not self.options.preserve_temp:
                         for imp in self.imports:
@@ -840,9 +883,6 @@ class Test:
                         print("Test files have been preserved in :" + test_folder)
                     sys.exit(1)
 
-                if self.options.allow_mp:
-                    p.close()
-                    p.terminate()
                 worked = False
                 critical_failed = False
 
@@ -878,13 +918,16 @@ class Test:
 
                 for iparallel, (r, o, e, c, script) in enumerate(parallel_execs):
                     if len(self.scripts) > 1:
-                        output += "stdout of script %s on %s :\n" % (script.get_name(), script.get_role())
+                        header = "stdout of script %s on %s :\n" % (script.get_name(), script.get_role())
+                        output += header
+                        parts.append(header)
                         err += "stderr of script %s on %s :\n" % (script.get_name(), script.get_role())
 
                     if r:
                         worked = True
                         output += o
                         err += e
+                        parts.append(remote_params[iparallel].sink)
 
                 if SectionScript.TYPE_EXIT in allowed_types:
                  for s,vlist in [(t.test,t.imp_v) for t in self.imports] + [(self, v)]:
@@ -914,6 +957,7 @@ class Test:
                             print("An error occured!", e)
                         #print(s_output, s_err)
                         output += s_output
+                        parts.append(s_output)
                         err += s_err
 
 
@@ -931,10 +975,8 @@ class Test:
                 new_data_results = {}
                 new_time_results = {}
                 new_time_results.setdefault("time", {})
-                regex_list = self.config.get_list("result_regex")
-
-                this_has_err, this_has_value = self.parse_results(regex_list, output, new_time_results,
-                                                                  new_data_results)
+                this_has_err, this_has_value = self.add_results(parser.matches(parts), new_time_results,
+                                                                new_data_results)
 
                 if this_has_err:
                     has_err = True
@@ -1177,12 +1219,23 @@ class Test:
             # If scripts is not in allowed_types, we have to run the init by force now
 
             self.do_init_all(build, options, do_test=do_test, allowed_types=allowed_types, v_internals=v_internals)
+            self.close_pool()
             if not self.options.preserve_temp:
                 shutil.rmtree(test_folder)
             return {}, {}, True
 
         all_data_results = OrderedDict()
         all_time_results = OrderedDict()
+        #With --shard, the results of this build are written to the results file of the shard
+        shard = getattr(options, 'shard', None)
+
+        # Versions where results can be taken from with --use-last, most recent first
+        history = None
+        if options.use_last and build.repo.url:
+            history = build.repo.method.get_history(build.version, limit=options.use_last)
+            result_index = ResultIndex(build.result_folder())
+            result_index.update(self, [Build(build.repo, version, options.result_path) for version in history])
+
         # If one first, we first ensure 1 result per variables then n_runs
         if options.onefirst:
             total_runs = [1, self.config["n_runs"]]
@@ -1192,7 +1245,7 @@ class Test:
         for runs_this_pass in total_runs:  # Number of results to ensure for this run
             n = 0
             overriden = set(build.repo.overriden_variables.keys())
-            all_variables = list(self.variables.expand(method=options.expand, overriden=overriden))
+            all_variables = self.variables.expand(method=options.expand, overriden=overriden, shard=shard)
             n_tests = len(all_variables)
             for root_variables in all_variables:
                 n += 1
@@ -1259,13 +1312,12 @@ class Test:
                                 nprev_kresults[trun] = results
                         nprev_time_results[kind] = nprev_kresults
                     prev_time_results = nprev_time_results
-                if not run_results and options.use_last and build.repo.url:
-                    for version in build.repo.method.get_history(build.version, limit=options.use_last):
-                        oldb = Build(build.repo, version, options.result_path)
-                        r = oldb.load_results(self)
+                if not run_results and history:
+                    version = result_index.lookup(self, run, history)
+                    if version is not None:
+                        r = Build(build.repo, version, options.result_path).load_results(self)
                         if r and run in r:
                             run_results = r[run]
-                            break
                 if not time_results and options.use_last and build.repo.url:
                     for version in build.repo.method.get_history(build.version, limit=options.use_last):
                         oldb = Build(build.repo, version, options.result_path)
@@ -1299,33 +1351,14 @@ class Test:
 
 
                 have_new_results = False
+                new_all_time_results = {}
 
                 #Compute the minimal number of existing results, so we know how much runs we must do
-                l=[]
-                dall=True
-                n_existing_results=[]
-                for result_type, results in run_results.items():
-                    if self.config.match("accept_zero", result_type):
-                        continue
-                    if not results:
-                        continue
-                    n_existing_results.append(len(results))
-                    if len(results) < runs_this_pass:
-                        l.append(result_type)
-                    else:
-                        dall=False
-
-                if len(n_existing_results) == 0:
-                    n_existing_results = 0
-                else:
-                    if options.min_test:
-                        n_existing_results = min(n_existing_results)
-                    else:
-                        n_existing_results = max(n_existing_results)
+                n_existing_results, l, dall = self.count_existing_results(run_results, runs_this_pass, options)
 
-                n_runs = runs_this_pass - (
-                    0 if (options.force_test or options.force_retest) or len(run_results) == 0 else n_existing_results)
-                if n_runs > 0 and do_test:
+                def run_point(n_runs, replace):
+                    """Execute n_runs more repetitions of this point and add their results to run_results"""
+                    nonlocal init_done, have_new_results
                     if not init_done:
                         self.do_init_all(build, options, do_test, allowed_types=allowed_types, test_folder=test_folder,
                                          v_internals=v_internals)
@@ -1334,9 +1367,6 @@ class Test:
                     def print_header(i, i_try):
                         pass
                     if not self.options.quiet:
-                        if len(run_results) > 0:
-                            if not dall:
-                                print("Results %s are missing some points..." % ", ".join(l))
                         if n_tests > 0:
                             def print_header(i, i_try):
                                 n_try=int(self.config["n_retry"])
@@ -1346,7 +1376,7 @@ class Test:
                                 print(
                                   ("[%srun %d/%d for test %d/%d"+(" of serie %d/%d" %(iserie+1,nseries) if nseries > 1 else "")+"]") % (  ("retrying %d/%d " % (i_try + 1,n_try)) if i_try > 0 else "", i+1, n_runs, n, n_tests))
 
-                    new_data_results, new_all_time_results, output, err, n_exec, n_err = self.execute(build, run, variables,
+                    new_data_results, point_time_results, output, err, n_exec, n_err = self.execute(build, run, variables,
                                                                                                   n_runs,
                                                                                                   n_retry=self.config[
                                                                                                       "n_retry"],
@@ -1354,11 +1384,13 @@ class Test:
                                                                                                       SectionScript.TYPE_SCRIPT, SectionScript.TYPE_EXIT},
                                                                                                   test_folder=test_folder,
                                                                                                   v_internals=v_internals, before_test = print_header)
+                    got_results = False
                     if new_data_results:
                         for result_type, values in new_data_results.items():
                             if values is None:
                                 continue
-                            if options.force_retest:
+                            got_results = True
+                            if replace:
                                 run_results[result_type] = values
                             else:
                                 if result_type in run_results and run_results[result_type] is not None:
@@ -1367,12 +1399,42 @@ class Test:
                                     run_results[result_type] = values
 
                             have_new_results = True
-                    if new_all_time_results:
+                    if point_time_results:
                         have_new_results = True
+                        for kind, kresults in point_time_results.items():
+                            for time, results in kresults.items():
+                                for result_type, result in results.items():
+                                    new_all_time_results.setdefault(kind, {}).setdefault(time, {}).setdefault(result_type, []).extend(result)
+                    return got_results
+
+                n_runs = runs_this_pass - (
+                    0 if (options.force_test or options.force_retest) or len(run_results) == 0 else n_existing_results)
+                if n_runs > 0 and do_test:
+                    if not self.options.quiet:
+                        if len(run_results) > 0:
+                            if not dall:
+                                print("Results %s are missing some points..." % ", ".join(l))
+                    run_point(n_runs, replace=options.force_retest)
                 else:
                     if not self.options.quiet:
                         print(run.format_variables(self.config["var_hide"]))
 
+                #Adaptive mode, run more until the confidence interval of all results is small enough
+                if do_test and float(self.config["n_runs_ci"]) > 0:
+                    while run_results:
+                        unstable = self.unstable_results(run_results)
+                        n_existing_results, l, dall = self.count_existing_results(run_results, runs_this_pass, options)
+                        if not unstable:
+                            break
+                        if n_existing_results >= int(self.config["n_runs_max"]):
+                            if not self.options.quiet:
+                                print("WARNING: Confidence interval of %s is still above %s%% after %d runs" % (", ".join(unstable), float(self.config["n_runs_ci"]) * 100, n_existing_results))
+                            break
+                        if not self.options.quiet:
+                            print("Confidence interval of %s is above %s%%, running once more..." % (", ".join(unstable), float(self.config["n_runs_ci"]) * 100))
+                        if not run_point(1, replace=False):
+                            break
+
                 if len(run_results) > 0:
                     if not self.options.quiet:
                         if len(run_results) == 1:
@@ -1413,21 +1475,28 @@ class Test:
                     thread.daemon = True
                     thread.start()
 
-                # Save results
+                # Save results, only the runs of this point are appended to the journal
                 if all_data_results and have_new_results:
                     if prev_results or prev_time_results:
                         if all_data_results[run]:
                             if prev_results is None:
                                 prev_results = {}
                             prev_results[run] = all_data_results[run]
-                        build.writeversion(self, prev_results, allow_overwrite=True)
                         for kind, kr in time_results.items():
                             prev_time_results.setdefault(kind,OrderedDict())
                             prev_time_results[kind].update(time_results[kind])
-                        build.writeversion(self, prev_time_results, allow_overwrite=True, kind=True, reload=False)
-                    else:
-                        build.writeversion(self, all_data_results, allow_overwrite=True)
-                        build.writeversion(self, all_time_results, allow_overwrite=True, kind=True)
+                    if all_data_results[run]:
+                        build.journalversion(self, {run: all_data_results[run]}, shard=shard)
+                    build.journalversion(self, time_results, kind=True, shard=shard)
+
+        self.close_pool()
+
+        if history:
+            result_index.close()
+
+        if do_test:
+            build.compact(self, shard=shard)
+            build.compact(self, kind=True, shard=shard)
 
         if not self.options.preserve_temp:
             try:
@@ -1450,6 +1519,80 @@ class Test:
             title = self.filename
         return title
 
+    def executor_pool(self, n) -> multiprocessing.pool.ThreadPool:
+        """
+        Return the pool of threads running the scripts, kept for the whole test
+        and grown to n workers if it is smaller. All scripts of a run must execute at once, as they may wait for each other.
+        """
+        if self._pool is not None and self._pool_size < n:
+            self.close_pool()
+        if self._pool is None:
+            self._pool = multiprocessing.pool.ThreadPool(n)
+            self._pool_size = n
+        return self._pool
+
+    def close_pool(self):
+        """
+        Stop the pool of threads running the scripts
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.terminate()
+            self._pool = None
+            self._pool_size = 0
+
+    def count_existing_results(self, run_results, runs_this_pass, options):
+        """
+        Compute the number of existing results for a run, the minimum or the maximum among all types
+        according to --min-test, the list of types missing results and if all types miss some
+        """
+        l=[]
+        dall=True
+        n_existing_results=[]
+        for result_type, results in run_results.items():
+            if self.config.match("accept_zero", result_type):
+                continue
+            if not results:
+                continue
+            n_existing_results.append(len(results))
+            if len(results) < runs_this_pass:
+                l.append(result_type)
+            else:
+                dall=False
+
+        if len(n_existing_results) == 0:
+            n_existing_results = 0
+        else:
+            if options.min_test:
+                n_existing_results = min(n_existing_results)
+            else:
+                n_existing_results = max(n_existing_results)
+        return n_existing_results, l, dall
+
+    def unstable_results(self, run_results):
+        """
+        List the result types whose relative confidence interval, at n_runs_confidence and after outliers rejection,
+        is above n_runs_ci
+        """
+        unstable = []
+        confidence = float(self.config["n_runs_confidence"])
+        for result_type, results in run_results.items():
+            if not results or self.config.match("accept_zero", result_type):
+                continue
+            if result_type in self.config.get_dict("var_n_runs"):
+                continue
+            data = self.reject_outliers(np.asarray(results, dtype=float))
+            if len(data) < 2:
+                unstable.append(result_type)
+                continue
+            mean = data.mean()
+            half = stats.t.ppf((1 + confidence) / 2, len(data) - 1) * data.std(ddof=1) / np.sqrt(len(data))
+            if half == 0:
+                continue
+            if mean == 0 or half / abs(mean) > float(self.config["n_runs_ci"]):
+                unstable.append(result_type)
+        return unstable
+
     def reject_outliers(self, data):
         m = self.config["accept_outliers_mult"]
         mean = np.mean(data)
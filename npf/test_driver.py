@@ -182,4 +182,5 @@ def group_series(filename: str, series: Series , time_series:Series, options) ->
                                 fileprefix=time_ns,
                                 options=options,
                                 title=options.graph_title)
+    grapher.wait()
     return series, time_series
@@ -0,0 +1,265 @@
+"""
+Columnar representation of a Dataset, and its binary storage.
+
+On disk, a dataset is stored in a folder holding a table of the variables of all runs (runs.json),
+and for each result type a float64 array with the values of all runs one after the other,
+an int64 array of offsets of each run inside the values and an int8 array telling if the type
+is absent, a list or None for each run. The arrays are saved as .npy files so they are mapped
+in memory instead of parsed.
+"""
+import json
+import os
+import shutil
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from npf import variable
+from npf.types.dataset import Run, Dataset
+
+COLUMNAR_EXT = '.columns'
+#Previous folder, kept while it is replaced
+OLD_EXT = '.old'
+
+STATE_ABSENT = 0
+STATE_LIST = 1
+STATE_NONE = 2
+
+
+class ColumnarDataset:
+    """
+    A Dataset stored by columns instead of run by run.
+
+    Variables are kept as one column per variable name, aligned with the list of runs, with None
+    where a run does not have that variable. For each result type, the values of all runs are stored
+    one after the other in a float64 array, with the offset of each run in that array and its state
+    (absent, list or None). The values of the i-th run are values[offsets[i]:offsets[i+1]].
+    """
+    def __init__(self, runs: List[Run], names: List[str], columns: Dict[str, List], results: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]]):
+        self.runs = runs
+        self.names = names
+        self.columns = columns
+        self.results = results
+
+    @staticmethod
+    def from_dataset(all_results: Dataset, runs: List[Run] = None) -> 'ColumnarDataset':
+        """
+        Build the columnar form of all_results
+
+        :param runs: Take only those runs, in this order. Runs not in all_results have no result.
+        """
+        if runs is None:
+            runs = list(all_results.keys())
+        all_run_results = [all_results.get(run, {}) for run in runs]
+
+        names = []
+        types = []
+        for run, results in zip(runs, all_run_results):
+            for k in run.read_variables().keys():
+                if k not in names:
+                    names.append(k)
+            for t in results.keys():
+                if t not in types:
+                    types.append(t)
+        names = sorted(names)
+
+        columns = OrderedDict()
+        for k in names:
+            columns[k] = [run.read_variables().get(k, None) for run in runs]
+
+        n = len(runs)
+        columnar_results = OrderedDict()
+        for t in types:
+            state = np.zeros(n, dtype=np.int8)
+            offsets = np.zeros(n + 1, dtype=np.int64)
+            values = []
+            for i, results in enumerate(all_run_results):
+                r = results.get(t, None)
+                if t not in results:
+                    pass
+                elif r is None:
+                    state[i] = STATE_NONE
+                else:
+                    state[i] = STATE_LIST
+                    if any(type(val) is list for val in r):
+                        for val in r:
+                            if type(val) is list:
+                                values.extend(val)
+                            else:
+                                values.append(val)
+                    else:
+                        values.extend(r)
+                offsets[i + 1] = len(values)
+            columnar_results[t] = (np.asarray(values, dtype=np.float64), offsets, state)
+        return ColumnarDataset(runs, names, columns, columnar_results)
+
+    def to_dataset(self) -> Dataset:
+        all_results = OrderedDict()
+        all_run_results = []
+        for run in self.runs:
+            results = {}
+            all_results[run] = results
+            all_run_results.append(results)
+
+        for t, (values, offsets, state) in self.results.items():
+            values = values.tolist()
+            offsets = offsets.tolist()
+            state = state.tolist()
+            for i, results in enumerate(all_run_results):
+                s = state[i]
+                if s == STATE_LIST:
+                    results[t] = values[offsets[i]:offsets[i + 1]]
+                elif s == STATE_NONE:
+                    results[t] = None
+        return all_results
+
+    def __len__(self):
+        return len(self.runs)
+
+    def result_types(self) -> List[str]:
+        return list(self.results.keys())
+
+    def column(self, name) -> np.ndarray:
+        return np.array(self.columns[name], dtype=object)
+
+    def values(self, t) -> np.ndarray:
+        return self.results[t][0]
+
+    def lengths(self, t) -> np.ndarray:
+        return np.diff(self.results[t][1])
+
+    def present(self, t) -> np.ndarray:
+        """
+        Mask of the runs having at least one value for the result type t
+        """
+        return self.lengths(t) > 0
+
+    def by_length(self, t):
+        """
+        Iterate over the runs having results of type t grouped by number of values,
+        yielding the indices of the runs and a 2D array with one row of values per run
+        """
+        values, offsets, state = self.results[t]
+        n = self.lengths(t)
+        for l in np.unique(n[state == STATE_LIST]):
+            idx = np.flatnonzero((n == l) & (state == STATE_LIST))
+            yield idx, values[offsets[idx][:, None] + np.arange(l)]
+
+    def sum(self, t) -> np.ndarray:
+        values, offsets, state = self.results[t]
+        sums = np.zeros(len(self.runs))
+        nonempty = self.present(t)
+        if len(values):
+            sums[nonempty] = np.add.reduceat(values, offsets[:-1][nonempty])
+        return sums
+
+    def mean(self, t) -> np.ndarray:
+        """
+        Mean of the values of each run for the result type t, NaN for runs without values
+        """
+        n = self.lengths(t)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(n > 0, self.sum(t) / n, np.nan)
+
+    def std(self, t) -> np.ndarray:
+        """
+        Population standard deviation of the values of each run for the result type t
+        """
+        values, offsets, state = self.results[t]
+        n = self.lengths(t)
+        mean = self.mean(t)
+        dev = (values - np.repeat(mean, n)) ** 2
+        sq = np.zeros(len(self.runs))
+        nonempty = n > 0
+        if len(values):
+            sq[nonempty] = np.add.reduceat(dev, offsets[:-1][nonempty])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(nonempty, np.sqrt(sq / n), np.nan)
+
+
+def write_columnar(path, all_results: Dataset):
+    """
+    Write all_results in the columnar format in the folder path
+    """
+    if not isinstance(all_results, ColumnarDataset):
+        all_results = ColumnarDataset.from_dataset(all_results)
+
+    #Written aside and moved in place so a reader never sees a half-written folder
+    tmp = path + '.tmp'
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+
+    runs = []
+    for i in range(len(all_results)):
+        row = []
+        for k in all_results.names:
+            val = all_results.columns[k][i]
+            if val is None:
+                row.append(None)
+            else:
+                if type(val) is tuple:
+                    val = val[1]
+                row.append(str(val))
+        runs.append(row)
+
+    for it, (values, offsets, state) in enumerate(all_results.results.values()):
+        np.save(os.path.join(tmp, "%d.values.npy" % it), values)
+        np.save(os.path.join(tmp, "%d.offsets.npy" % it), offsets)
+        np.save(os.path.join(tmp, "%d.state.npy" % it), state)
+
+    with open(os.path.join(tmp, "runs.json"), 'w') as f:
+        json.dump({"variables": all_results.names, "types": all_results.result_types(), "runs": runs}, f)
+    #The previous folder is moved aside before the new one takes its place, and only then deleted
+    _recover(path)
+    old = path + OLD_EXT
+    if os.path.exists(old):
+        shutil.rmtree(old)
+    if os.path.exists(path):
+        os.rename(path, old)
+    os.rename(tmp, path)
+    if os.path.exists(old):
+        shutil.rmtree(old)
+
+
+def read_columnar(path) -> ColumnarDataset:
+    """
+    Read a dataset written by write_columnar. The arrays of values are mapped read-only, so they are only read
+    from the disk when used, e.g. by to_dataset() that converts them per result type in a single pass.
+    """
+    with open(os.path.join(path, "runs.json"), 'r') as f:
+        table = json.load(f)
+    names = table["variables"]
+    numeric = [variable.is_numeric(k) for k in names]
+
+    runs = []
+    columns = OrderedDict((k, []) for k in names)
+    for row in table["runs"]:
+        variables = OrderedDict()
+        for k, num, v in zip(names, numeric, row):
+            if v is not None:
+                v = variable.get_numeric(v) if num else v
+                variables[k] = v
+            columns[k].append(v)
+        runs.append(Run(variables))
+
+    results = OrderedDict()
+    for it, t in enumerate(table["types"]):
+        results[t] = (np.load(os.path.join(path, "%d.values.npy" % it), mmap_mode='r'),
+                      np.load(os.path.join(path, "%d.offsets.npy" % it), mmap_mode='r'),
+                      np.load(os.path.join(path, "%d.state.npy" % it), mmap_mode='r'))
+    return ColumnarDataset(runs, names, columns, results)
+
+
+def _recover(path):
+    """
+    Put back the previous folder of path if a write was interrupted after moving it aside
+    """
+    if not os.path.exists(path) and os.path.exists(os.path.join(path + OLD_EXT, "runs.json")):
+        os.rename(path + OLD_EXT, path)
+
+
+def has_columnar(path):
+    _recover(path)
+    return os.path.exists(os.path.join(path, "runs.json"))
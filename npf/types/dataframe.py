@@ -0,0 +1,52 @@
+"""
+Conversion of the series of a graph to a pandas DataFrame, for the CSV (--pandas), web and notebook exports.
+
+The DataFrame has one row per value of each run, with the columns build, test_index, the variables of the run,
+y_<type> for each result type, NaN past the last value of that type, and run_index, the position of the value in
+the results of the run. Columns are ordered by first appearance, and cells of runs without a column are NaN.
+"""
+from collections import OrderedDict
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+
+def results_dataframe(datasets: List[tuple]) -> pd.DataFrame:
+    """
+    Build the DataFrame of datasets, a list of (test, build, all_results), filling the list of values of
+    each column for all series in one pass and creating the DataFrame once
+    """
+    columns = OrderedDict()
+    n = 0
+    for test, build, all_results in datasets:
+        build_name = build.pretty_name()
+        for i, (run, results) in enumerate(all_results.items()):
+            if len(run) == 0 or not results:
+                continue
+            try:
+                ys = OrderedDict(("y_" + k, list(v) if v is not None else []) for k, v in results.items())
+                l = max(len(v) for v in ys.values())
+            except Exception:
+                print("ERROR: When trying to export serie %s:" % build_name)
+                continue
+            if l == 0:
+                continue
+
+            row = OrderedDict()
+            row['build'] = [build_name] * l
+            row['test_index'] = [i] * l
+            for k, v in run.read_variables().items():
+                row[k[1] if type(k) is tuple else k] = [v[1] if type(v) is tuple else v] * l
+            for k, v in ys.items():
+                row[k] = v + [np.nan] * (l - len(v))
+            row['run_index'] = list(range(l))
+
+            for k in row.keys():
+                if k not in columns:
+                    columns[k] = [np.nan] * n
+            for k, column in columns.items():
+                values = row.get(k, None)
+                column.extend(values if values is not None else [np.nan] * l)
+            n += l
+    return pd.DataFrame(columns)
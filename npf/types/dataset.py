@@ -9,24 +9,53 @@ else:
     from ordered_set import OrderedSet
 import natsort
 import csv
+import weakref
 
 from npf import npf
 from npf.variable import is_numeric, get_numeric, numeric_dict
 
 from npf.types.web.web import prepare_web_export
 
+class _RunKey:
+    """
+    Interned key of runs, shared by all the runs having the same variables
+    """
+    __slots__ = ('key', '__weakref__')
+
+    def __init__(self, key):
+        self.key = key
+
+
+# Interning table of run keys. Equal runs get the very same key object, whatever build they come from,
+# so their key is stored only once and they are compared by identity. Keys are only referenced weakly,
+# they leave the table with the last run using them.
+_run_keys = weakref.WeakValueDictionary()
+
+
+def _normalize(v):
+    if type(v) is tuple:
+        v = v[1]
+    if is_numeric(v):
+        n = get_numeric(v)
+        if np.isfinite(n):
+            return n
+    return str(v)
+
+
 class Run:
+    __slots__ = ('_variables', '_key', '_hash')
+
     def __init__(self, variables):
         self._variables = variables
+        self._key = None
         self._hash = None
-        self._data_repr = None
 
     def read_variables(self) -> Final[Dict]:
         return self._variables
 
     def write_variables(self) -> Dict:
+        self._key = None
         self._hash = None
-        self._data_repr = None
         return self._variables
 
     @property
@@ -77,42 +106,47 @@ class Run:
 
         difs = set.difference(set(self._variables.keys()), common)
         for dif in difs:
+            self._key = None
             self._hash = None
-            self._data_repr = None
             del self._variables[dif]
         return self
 
-    def data_repr(self):
-        if self._data_repr is not None:
-            return self._data_repr
-        r=""
-        for k, v in sorted(self._variables.items()):
-            if type(v) is tuple:
-                v = v[1]
-            r = r+str(k)+str(v)
-        self._data_repr = r
-        return r
+    def key(self) -> Tuple:
+        """
+        The interned tuple of (name, value) sorted by name identifying this run.
+        Numerical values are normalized so 1, 1.0 and "1" give the same key.
+        """
+        return self._interned().key
+
+    def _interned(self) -> _RunKey:
+        if self._key is None:
+            key = tuple(sorted(((k, _normalize(v)) for k, v in self._variables.items()), key=lambda kv: kv[0]))
+            interned = _run_keys.get(key, None)
+            if interned is None:
+                interned = _run_keys.setdefault(key, _RunKey(key))
+            self._key = interned
+        return self._key
 
     def __eq__(self, o):
-        if len(self._variables) != len(o._variables):
+        if not isinstance(o, Run):
             return False
-        return  self.data_repr() == o.data_repr()
+        key = self._interned()
+        okey = o._interned()
+        #Keys made at once by two threads may not be the same object
+        return key is okey or key.key == okey.key
 
     def __hash__(self):
-        if self._hash is not None:
-            return self._hash
-        n = 0
-        for k, v in self._variables.items():
-            if type(v) is tuple:
-                v = v[1]
-            if is_numeric(v):
-                n += get_numeric(v).__hash__()
-            else:
-                n += str(v).__hash__()
-            n += k.__hash__()
-        self._hash = n
-        return n
+        if self._hash is None:
+            self._hash = hash(self.key())
+        return self._hash
 
+    def __getstate__(self):
+        return self._variables
+
+    def __setstate__(self, variables):
+        self._variables = variables
+        self._key = None
+        self._hash = None
 
     def __repr__(self):
         return "Run(" + self.format_variables() + ")"
@@ -197,6 +231,54 @@ def group_val(result, t):
                                print("WARNING : Unknown format %s" % t)
                                return np.nan
 
+def _group_all(all_results, run_list, columnar, result_type, group):
+    """
+    Compute the y value and the (mean, std, results) tuple of result_type for all runs of run_list at once,
+    giving the same values than group_val, np.mean and np.std on each run.
+    Runs with the same number of results are stacked in a 2D array and reduced along rows.
+    """
+    n = len(run_list)
+    y = [np.nan] * n
+    means = np.full(n, np.nan)
+    stds = np.full(n, np.nan)
+    done = np.zeros(n, dtype=bool)
+    if result_type in columnar.results:
+        for idx, a in columnar.by_length(result_type):
+            if a.shape[1] == 0:
+                continue
+            means[idx] = np.mean(a, axis=1)
+            stds[idx] = np.std(a, axis=1)
+            if group == 'mean' or group == 'avg':
+                g = means[idx]
+            elif group == 'std':
+                g = stds[idx]
+            elif group == 'min':
+                g = np.min(a, axis=1)
+            elif group == 'max':
+                g = np.max(a, axis=1)
+            elif group[:4] == 'perc':
+                g = np.percentile(a, int(group[4:]), axis=1)
+            elif group == 'median' or group == 'med':
+                g = np.median(a, axis=1)
+            else:
+                continue
+            for i, v in zip(idx, g):
+                y[i] = v
+            done[idx] = True
+
+    e = []
+    for i, run in enumerate(run_list):
+        result = all_results.get(run, OrderedDict()).get(result_type, None)
+        if result is None:
+            e.append((np.nan, np.nan, [np.nan]))
+        elif done[i]:
+            e.append((means[i], stds[i], result))
+        else:
+            #Empty results or y group without a batched version
+            y[i] = group_val(result, group)
+            e.append((np.mean(result), np.std(result), result))
+    return y, e
+
 def prepare_result_types(datasets):
     all_result_types = OrderedSet()
 
@@ -288,51 +370,50 @@ def convert_to_xyeb(datasets: List[Tuple['Test', 'Build' , Dataset]], run_list,
             for result_type,results in run_results.items():
                 all_result_types.add(result_type)
 
+    from npf.types.columnar import ColumnarDataset
+
     for test, build, all_results in datasets:
-        x = OrderedDict()
-        y = OrderedDict()
-        e = OrderedDict()
+        if len(run_list) == 0:
+            continue
+        xdiv = var_divider(test, key)
+        x = []
         for run in run_list:
             if len(run) == 0:
                 xval = build.pretty_name()
             else:
                 xval = run.print_variable(key, build.pretty_name())
 
-            results_types = all_results.get(run, OrderedDict())
-            for result_type in all_result_types:
-
-                #ydiv = var_divider(test, "result", result_type) results are now divided before
-                xdiv = var_divider(test, key)
-                result = results_types.get(result_type,None)
-
-                if xdiv != 1 and is_numeric(xval):
-                    x.setdefault(result_type, []).append(get_numeric(xval) / xdiv)
-                else:
-                    x.setdefault(result_type, []).append(xval)
-
-                if result is not None:
-                    yval = group_val(result, y_group[result_type] if result_type in y_group else ( y_group['result'] if 'result' in y_group else 'mean'))
-                    y.setdefault(result_type, []).append(yval)
+            if xdiv != 1 and is_numeric(xval):
+                x.append(get_numeric(xval) / xdiv)
+            else:
+                x.append(xval)
 
-                    std = np.std(result)
-                    mean = np.mean(result)
-                    e.setdefault(result_type, []).append((mean, std, result))
-                else:
-                    y.setdefault(result_type, []).append(np.nan)
-                    e.setdefault(result_type, []).append((np.nan, np.nan, [np.nan]))
+        columnar = ColumnarDataset.from_dataset(all_results, runs=run_list)
+        y = OrderedDict()
+        e = OrderedDict()
+        for result_type in all_result_types:
+            #ydiv = var_divider(test, "result", result_type) results are now divided before
+            group = y_group[result_type] if result_type in y_group else ( y_group['result'] if 'result' in y_group else 'mean')
+            y[result_type], e[result_type] = _group_all(all_results, run_list, columnar, result_type, group)
 
+        if do_x_sort:
+            try:
+                order = np.argsort(x)
+            except Exception as err:
+                order = err
 
-        for result_type in x.keys():
+        for result_type in all_result_types:
 
           try:
 
             if not do_x_sort:
-                ox = x[result_type]
+                ox = list(x)
                 oy = y[result_type]
                 oe = e[result_type]
             else:
-                order = np.argsort(x[result_type])
-                ox = np.array(x[result_type])[order]
+                if isinstance(order, Exception):
+                    raise order
+                ox = np.array(x)[order]
                 oy = np.array(y[result_type])[order]
                 oe = [e[result_type][i] for i in order]
 
@@ -341,7 +422,7 @@ def convert_to_xyeb(datasets: List[Tuple['Test', 'Build' , Dataset]], run_list,
           except Exception as err:
               print("ERROR while transforming data")
               print(err)
-              print("x",x[result_type])
+              print("x",x)
               print("y",y[result_type])
               print("e",e[result_type])
 
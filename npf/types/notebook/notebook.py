@@ -11,12 +11,15 @@ import time
 
 import pandas as pd
 from npf.graph_choice import decide_graph_type
+from npf.types.dataframe import results_dataframe
 
 TEMPLATE_PATH = "npf/types/notebook/template.ipynb"
 INDENT_DATA = False
 
 
 def prepare_notebook_export(datasets: List[tuple], all_results_df: pd.DataFrame, path: str, config):
+    if all_results_df is None:
+        all_results_df = results_dataframe(datasets)
     # SIMTODO: (help) why could there be multiple datasets?
     # TODO: with npf-compare there might be multiple dataset. Try the netperf vs iperf experiment from the examples
     dataset = datasets[0]
@@ -2,7 +2,11 @@ import uuid
 
 from npf_web_extension import app
 
+from npf.types.dataframe import results_dataframe
+
 def prepare_web_export(datasets, all_results_df, path):
+    if all_results_df is None:
+        all_results_df = results_dataframe(datasets)
     # TODO: (error) this code loops but doesn't save the different datasets.
     # Getting parameters and measurements
     name = "undefined"
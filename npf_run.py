@@ -207,9 +207,14 @@ def main():
                     print("Previous build %s could not be found, we will not compare !" % last_build.version)
                     last_build = None
 
+            if args.merge_shards:
+                n = build.merge_shards(test)
+                if n:
+                    print("Merged the results of %d shards" % n)
+
             try:
-                prev_results = build.load_results(test)
-                prev_time_results = build.load_results(test, kind=True)
+                prev_results = build.load_results(test, shard=args.shard)
+                prev_time_results = build.load_results(test, kind=True, shard=args.shard)
             except FileNotFoundError:
                 prev_results = None
                 prev_time_results = None
@@ -281,12 +286,16 @@ def main():
                           filename = filename,
                           fileprefix = time_ns,
                           options = args)
+            grapher.wait()
         if last_build and args.graph_num > 0:
             graph_builds = [last_build] + graph_builds[:-1]
         last_build = build
         if args.compare:
             print("[%s] Finished run for %s, %d/%d tests passed" % (repo.name, build.version, nok, ntests))
 
+    if args.debug:
+        print("Results cache : %s" % Build.cache)
+
     sys.exit(returncode)
 
 